@@ -1,19 +1,23 @@
-import base64
-from mcp.server.fastmcp import FastMCP, Image
-from tools.say_greeting import say_greeting
-from tools.capture_screen import capture_screen
-from tools.google_genai import generate_text_from_google
-from tools.subarea_tool import get_subarea_description
-from tools.input_controller import control_input
+from utils.tool_registry import register_tools, mark_startup_complete
+from mcp.server.fastmcp import FastMCP
+from utils.frame_ring_buffer import start_capture_daemon_from_env
 
 # Initialize FastMCP server
 mcp = FastMCP("interactive-gui-mcp")
 
-mcp.tool()(say_greeting)
-mcp.tool()(capture_screen)
-mcp.tool()(generate_text_from_google)
-mcp.tool()(get_subarea_description)
-mcp.tool()(control_input)
+# 工具模組各自在第一次使用時才載入 google.genai、pyautogui、mss 等重量級套件；
+# 匯入失敗的模組會以「不可用」的工具註冊，而不會讓伺服器無法啟動
+register_tools(mcp, "tools.say_greeting", ["say_greeting"])
+register_tools(mcp, "tools.capture_screen", ["capture_screen", "capture_screens", "list_monitors"])
+register_tools(mcp, "tools.google_genai", ["generate_text_from_google", "generate_text_from_google_with_stats", "get_genai_cache_stats"])
+register_tools(mcp, "tools.subarea_tool", ["get_subarea_description"])
+register_tools(mcp, "tools.region_proposer", ["propose_subareas"])
+register_tools(mcp, "tools.input_controller", ["control_input", "cancel_control_input"])
+register_tools(mcp, "tools.act_and_observe", ["act_and_observe"])
+register_tools(mcp, "tools.server_status", ["get_server_status", "get_performance_metrics"])
+mark_startup_complete()
 
 if __name__ == "__main__":
-    mcp.run(transport='stdio')
\ No newline at end of file
+    # 設定 MCP_CAPTURE_DAEMON=1 以啟用背景擷取 (見 README)
+    start_capture_daemon_from_env()
+    mcp.run(transport='stdio')
@@ -0,0 +1,136 @@
+import time
+from typing import List, Literal, Optional
+
+from mcp.server.fastmcp import Context
+from pydantic import BaseModel
+
+from utils.bounds import SubAreaBounds
+from utils.screen_grabber import ImageFormat
+from .capture_screen import ScreenCaptureInfo, capture_screen_frame
+from .input_controller import Command, InputControlResult, InputProfile, control_input
+from .subarea_tool import describe_frame_subareas
+
+class ActAndObserveResult(BaseModel):
+    input_result: InputControlResult
+    capture: Optional[ScreenCaptureInfo] = None # 未擷取時為 None (批次被取消，或出錯且 observe_on_error=False)
+    descriptions: Optional[dict[str, str]] = None # 只有提供 describe_prompt 時才會填入
+    timings_ms: dict[str, float] # 各階段耗時: act, capture, describe, total
+
+class _ProgressAfter:
+    """
+    Context wrapper for the describe stage: MCP progress values must only grow, so the per-crop
+    progress continues after the control_input progress (one step per command) instead of restarting.
+    """
+
+    def __init__(self, ctx: Context, offset: int):
+        self._ctx = ctx
+        self._offset = offset
+
+    async def report_progress(self, progress: float, total: Optional[float] = None, message: Optional[str] = None) -> None:
+        await self._ctx.report_progress(self._offset + progress, self._offset + total if total else None, message=message)
+
+    def __getattr__(self, name):
+        return getattr(self._ctx, name)
+
+async def act_and_observe(
+    commands: List[Command],
+    current_working_dir: str,
+    profile: InputProfile = "default",
+    image_format: ImageFormat = "png",
+    png_compress_level: int = 1,
+    quality: int = 85,
+    inline: bool = False,
+    diff_mode: bool = False,
+    diff_tile_size: int = 32,
+    diff_pixel_threshold: int = 0,
+    describe_prompt: Optional[str] = None,
+    describe_bounds: Optional[list[SubAreaBounds]] = None,
+    describe_mode: Literal["per_image", "multi_image", "contact_sheet"] = "per_image",
+    save_crops: bool = True,
+    model: Optional[str] = None,
+    stream: bool = False,
+    observe_on_error: bool = True,
+    ctx: Context = None,
+) -> ActAndObserveResult:
+    """
+    Runs a control_input batch, captures the screen right after it and optionally describes the result,
+    all in one tool call instead of separate control_input / capture_screen / get_subarea_description calls.
+
+    Args:
+        commands: Commands for control_input (see control_input for the Command fields).
+        current_working_dir: Working directory; captures and crops are written to its 'tmp' folder.
+        profile: control_input latency profile ("instant", "default" or "human").
+        image_format, png_compress_level, quality, inline: Passed to capture_screen.
+        diff_mode, diff_tile_size, diff_pixel_threshold: Passed to capture_screen; with diff_mode only the
+                                                         regions that changed since the previous capture are returned.
+        describe_prompt: If given, the observed screen is described with this prompt.
+        describe_bounds: Sub-areas to describe. Defaults to the changed regions in diff_mode, otherwise the whole screen.
+        describe_mode: Passed to get_subarea_description as mode.
+        save_crops, model, stream: Passed to get_subarea_description; each description is also sent as an
+                                   MCP progress notification as soon as it is ready.
+        observe_on_error: Whether to still capture (and describe) when the batch ends with an error.
+                          A cancelled batch is never observed.
+
+    Returns:
+        An ActAndObserveResult with the control_input result, the capture info, the descriptions keyed by
+        sub-area path and per-stage timings in milliseconds.
+    """
+    timings = {}
+    started = time.perf_counter()
+
+    stage_started = time.perf_counter()
+    input_result = await control_input(commands, profile=profile, ctx=ctx)
+    timings["act"] = round((time.perf_counter() - stage_started) * 1000, 3)
+
+    result = ActAndObserveResult(input_result=input_result, timings_ms={})
+    if input_result.status == "cancelled" or (input_result.status == "error" and not observe_on_error):
+        timings["total"] = round((time.perf_counter() - started) * 1000, 3)
+        result.timings_ms = timings
+        return result
+
+    # completed_at 讓背景擷取 daemon 提供指令完成之後的畫面
+    stage_started = time.perf_counter()
+    capture, frame = await capture_screen_frame(
+        current_working_dir,
+        image_format=image_format,
+        png_compress_level=png_compress_level,
+        quality=quality,
+        inline=inline,
+        frame_timestamp=input_result.completed_at,
+        diff_mode=diff_mode,
+        diff_tile_size=diff_tile_size,
+        diff_pixel_threshold=diff_pixel_threshold,
+    )
+    timings["capture"] = round((time.perf_counter() - stage_started) * 1000, 3)
+    result.capture = capture
+
+    if describe_prompt and frame is not None:
+        if describe_bounds is not None:
+            bounds_list = describe_bounds
+        elif diff_mode:
+            bounds_list = capture.changed_regions or []
+        else:
+            bounds_list = [SubAreaBounds(x=0, y=0, width=capture.width, height=capture.height)]
+
+        stage_started = time.perf_counter()
+        if bounds_list:
+            # 直接裁剪剛擷取的同一張畫面 (不重新查找 daemon 或上一次擷取的畫面)，也不必重新讀取截圖檔
+            result.descriptions = await describe_frame_subareas(
+                frame,
+                image_path=capture.file_path,
+                bounds_list=bounds_list,
+                prompt=describe_prompt,
+                current_working_dir=current_working_dir,
+                mode=describe_mode,
+                save_crops=save_crops,
+                model=model,
+                stream=stream,
+                ctx=_ProgressAfter(ctx, len(commands)) if ctx is not None else None,
+            )
+        else:
+            result.descriptions = {} # diff_mode 下畫面沒有變化
+        timings["describe"] = round((time.perf_counter() - stage_started) * 1000, 3)
+
+    timings["total"] = round((time.perf_counter() - started) * 1000, 3)
+    result.timings_ms = timings
+    return result
@@ -1,55 +1,369 @@
-import mss
-from PIL import Image as PillowImage # 新增 Pillow 導入
 import base64
-import os
+import sys
 from pathlib import Path
+from typing import Optional
 from pydantic import BaseModel # 新增 Pydantic 導入
 # utils.path_utils から _normalize_path をインポートする
 from utils.path_utils import _normalize_path
-# import urllib.parse # For URL decoding path components - Moved to path_utils
-# import platform # To check OS - Moved to path_utils
-# import re # Import re for regex matching - Moved to path_utils
+from utils.bounds import SubAreaBounds
+from utils.frame_diff import changed_regions
+from utils.frame_ring_buffer import get_buffered_frame
+from utils.perf_metrics import increment, span
+from utils.tmp_retention import enforce_retention
+from utils.screen_grabber import (
+    FORMAT_EXTENSIONS,
+    FORMAT_MIME_TYPES,
+    Frame,
+    ImageFormat,
+    encode_frame,
+    find_window,
+    get_monitors,
+    grab_monitor,
+    grab_region,
+    run_in_capture_thread,
+    run_in_capture_threads,
+)
+
+class CaptureTarget(BaseModel):
+    """What to capture. window_title takes precedence over region, which takes precedence over monitor."""
+    monitor: int = 1 # 1 = 主螢幕，0 = 所有螢幕合成一張圖
+    region: Optional[SubAreaBounds] = None # 螢幕座標 (與 control_input 的 x/y 相同)
+    window_title: Optional[str] = None # 標題包含此字串的第一個可見視窗
+
+class MonitorInfo(BaseModel):
+    index: int
+    left: int
+    top: int
+    width: int
+    height: int
 
 class ScreenCaptureInfo(BaseModel):
     file_path: str
     width: int
     height: int
+    image_format: str = "png"
+    mime_type: str = "image/png"
+    byte_size: int = 0
+    image_base64: Optional[str] = None # 只有 inline=True 時才會填入
+    timestamp: float = 0.0 # 畫面擷取時間 (time.time())
+    # 影像像素 (x, y) 對應的 control_input 座標為 (left + x / scale, top + y / scale)
+    left: int = 0
+    top: int = 0
+    scale: float = 1.0 # 每個螢幕座標單位的影像像素數 (DPI 縮放)
+    monitor: Optional[int] = None # 以螢幕為目標時的螢幕編號
+    # 以下欄位只在 diff_mode=True 時填入
+    changed_regions: Optional[list[SubAreaBounds]] = None
+    region_paths: Optional[list[str]] = None
+    region_images_base64: Optional[list[str]] = None
+
+# 最近一次擷取的原始 BGRA 畫面，留在記憶體中供後續步驟使用
+_last_frame: Optional[Frame] = None
+
+def get_last_frame() -> Optional[Frame]:
+    """Returns the most recent in-memory frame captured by capture_screen, if any."""
+    return _last_frame
+
+def _target_area(target: CaptureTarget) -> Optional[tuple[int, int, int, int]]:
+    """(left, top, width, height) in screen coordinates for region and window targets, None for monitors."""
+    if target.window_title:
+        return find_window(target.window_title)
+    if target.region is not None:
+        r = target.region
+        return r.x, r.y, r.width, r.height
+    return None
+
+def _grab_target(target: CaptureTarget) -> Frame:
+    area = _target_area(target)
+    if area is None:
+        return grab_monitor(target.monitor)
+    return grab_region(*area)
+
+def _get_frame(frame_timestamp: Optional[float], target: Optional[CaptureTarget] = None) -> Frame:
+    # 背景擷取 daemon 有合適的畫面時直接使用 (區域目標從中裁剪)，否則即時擷取
+    target = target or CaptureTarget()
+    area = _target_area(target)
+    # ring buffer 的 slot 會被覆寫 (只有一個 slot 時每次擷取都會)，取經 seqlock 檢查的私有副本
+    frame = get_buffered_frame(frame_timestamp, copy=True) if area is not None or target.monitor == 1 else None
+    if frame is not None:
+        if area is None:
+            return frame
+        left, top, width, height = area
+        x0, y0 = round((left - frame.left) * frame.scale), round((top - frame.top) * frame.scale)
+        x1, y1 = x0 + round(width * frame.scale), y0 + round(height * frame.scale)
+        if x0 >= 0 and y0 >= 0 and x1 <= frame.width and y1 <= frame.height:
+            return frame.crop(x0, y0, x1 - x0, y1 - y0)
+    return _grab_target(target)
+
+def _grab_and_encode(image_format: ImageFormat, png_compress_level: int, quality: int,
+                     frame_timestamp: Optional[float], target: Optional[CaptureTarget] = None) -> tuple[Frame, bytes]:
+    with span("capture.grab"):
+        frame = _get_frame(frame_timestamp, target)
+    with span(f"capture.encode.{image_format}"):
+        encoded = encode_frame(frame, image_format, png_compress_level=png_compress_level, quality=quality)
+    increment("capture.frames")
+    increment("capture.encoded_bytes", len(encoded))
+    return frame, encoded
+
+def _grab_and_diff(previous: Optional[Frame], image_format: ImageFormat, png_compress_level: int, quality: int,
+                   frame_timestamp: Optional[float], tile_size: int, pixel_threshold: int,
+                   target: Optional[CaptureTarget] = None) -> tuple[Frame, list[SubAreaBounds], list[bytes]]:
+    with span("capture.grab"):
+        frame = _get_frame(frame_timestamp, target)
+    if previous is not None and (previous.left, previous.top) != (frame.left, frame.top):
+        previous = None # 擷取目標不同，無法比較
+    with span("capture.diff"):
+        regions = changed_regions(previous, frame, tile_size=tile_size, pixel_threshold=pixel_threshold)
+    # 只編碼有變化的區域
+    with span(f"capture.encode.{image_format}"):
+        crops = [
+            encode_frame(frame.crop(r.x, r.y, r.width, r.height), image_format,
+                         png_compress_level=png_compress_level, quality=quality)
+            for r in regions
+        ]
+    increment("capture.frames")
+    increment("capture.encoded_bytes", sum(len(c) for c in crops))
+    return frame, regions, crops
 
-async def capture_screen(current_working_dir: str) -> ScreenCaptureInfo:
+def _file_stem(target: CaptureTarget) -> str:
+    # 預設目標沿用 screenshot.<ext>；其他目標各自使用不同檔名，平行擷取時不會互相覆寫
+    if target.window_title or target.region is not None:
+        if target.region is not None and not target.window_title:
+            r = target.region
+            return f"screenshot_x{r.x}_y{r.y}_w{r.width}_h{r.height}"
+        safe_title = "".join(c if c.isalnum() else "_" for c in target.window_title)[:40]
+        return f"screenshot_window_{safe_title}"
+    return "screenshot" if target.monitor == 1 else f"screenshot_monitor{target.monitor}"
+
+def _info(frame: Frame, image_format: ImageFormat, byte_size: int, target: CaptureTarget) -> ScreenCaptureInfo:
+    return ScreenCaptureInfo(
+        file_path="",
+        width=frame.width, # 尺寸直接取自擷取結果，不再重新開檔
+        height=frame.height,
+        image_format=image_format,
+        mime_type=FORMAT_MIME_TYPES[image_format],
+        byte_size=byte_size,
+        timestamp=frame.timestamp,
+        left=frame.left,
+        top=frame.top,
+        scale=round(frame.scale, 4),
+        monitor=None if target.window_title or target.region is not None else target.monitor,
+    )
+
+def _write_files(paths_and_data: list[tuple[Path, bytes]], retention_dir: Optional[Path] = None) -> None:
+    with span("capture.write"):
+        for path, data in paths_and_data:
+            path.write_bytes(data)
+        if retention_dir is not None:
+            enforce_retention(retention_dir)
+
+async def capture_screen(
+    current_working_dir: str,
+    image_format: ImageFormat = "png",
+    png_compress_level: int = 1,
+    quality: int = 85,
+    inline: bool = False,
+    frame_timestamp: Optional[float] = None,
+    diff_mode: bool = False,
+    diff_tile_size: int = 32,
+    diff_pixel_threshold: int = 0,
+    monitor: int = 1,
+    region: Optional[SubAreaBounds] = None,
+    window_title: Optional[str] = None,
+) -> ScreenCaptureInfo:
     """
-    Captures the entire screen, saves it to a /tmp directory
-    within the provided current_working_dir, and returns the file path along with image dimensions.
+    Captures the screen (the primary monitor by default, or another monitor, all monitors, a rectangle
+    or a window), saves it to a /tmp directory within the provided current_working_dir, and returns the
+    file path along with image dimensions and the metadata that maps image pixels to control_input
+    coordinates: screen point = (left + x / scale, top + y / scale).
     The current_working_dir is normalized, and a normalized file_path is returned.
+
+    Args:
+        current_working_dir: The current working directory; the screenshot is written to its 'tmp' folder.
+        image_format: Output encoding: "png" (default), "bmp", "jpeg", "webp" or "raw" (BGRA bytes, width*height*4).
+        png_compress_level: zlib level (0-9) used for PNG. Low levels encode much faster on large screens.
+        quality: Quality (1-100) used for JPEG and WebP.
+        inline: If True, nothing is written to disk; the encoded image is returned base64-encoded in image_base64
+                and file_path is empty.
+        frame_timestamp: When the background capture daemon is running, use the first buffered frame captured
+                         at or after this time (e.g. control_input's completed_at) instead of the latest one.
+                         Falls back to a live grab if no such frame exists yet.
+        diff_mode: If True, the frame is compared tile by tile with the previous capture_screen frame and only the
+                   changed regions are encoded. They are returned in changed_regions (SubAreaBounds, ready for
+                   get_subarea_description) and written to tmp/changes/ (region_paths) or returned inline
+                   (region_images_base64). The full screenshot is not written and file_path is empty.
+                   The first call, or a resolution change, reports the whole screen as one region.
+        diff_tile_size: Tile edge in pixels used by diff_mode.
+        diff_pixel_threshold: Per-channel difference ignored by diff_mode (0 = any change counts).
+        monitor: Monitor to capture: 1 = primary (default), 2.. = other monitors, 0 = all monitors as one image
+                 (see list_monitors).
+        region: Capture only this rectangle, given in screen coordinates (the ones control_input uses). Grabbing
+                and encoding a small region is much cheaper than a whole monitor.
+        window_title: Capture the first visible window whose title contains this text (needs pygetwindow,
+                      i.e. Windows or macOS). Takes precedence over region and monitor.
+    """
+    target = CaptureTarget(monitor=monitor, region=region, window_title=window_title)
+    info, _ = await capture_screen_frame(
+        current_working_dir, image_format, png_compress_level, quality, inline,
+        frame_timestamp, diff_mode, diff_tile_size, diff_pixel_threshold, target,
+    )
+    return info
+
+async def capture_screen_frame(current_working_dir: str, image_format: ImageFormat = "png", png_compress_level: int = 1,
+                               quality: int = 85, inline: bool = False, frame_timestamp: Optional[float] = None,
+                               diff_mode: bool = False, diff_tile_size: int = 32, diff_pixel_threshold: int = 0,
+                               target: Optional[CaptureTarget] = None) -> tuple[ScreenCaptureInfo, Optional[Frame]]:
     """
+    capture_screen for Python callers that also need the captured Frame itself (None on error), e.g. to
+    crop exactly the pixels that were returned rather than looking a frame up again later.
+    """
+    global _last_frame
+    target = target or CaptureTarget()
     try:
+        if diff_mode:
+            return await _capture_changed_regions(
+                current_working_dir, image_format, png_compress_level, quality, inline,
+                frame_timestamp, diff_tile_size, diff_pixel_threshold, target,
+            )
+
+        # 擷取與編碼都在專用的擷取執行緒上進行，沿用同一個長駐的 mss 實例
+        frame, encoded = await run_in_capture_thread(
+            _grab_and_encode, image_format, png_compress_level, quality, frame_timestamp, target
+        )
+        _last_frame = frame
+
+        info = _info(frame, image_format, len(encoded), target)
+
+        if inline:
+            info.image_base64 = base64.b64encode(encoded).decode("ascii")
+            return info, frame
+
         # 標準化 current_working_dir
         normalized_cwd = _normalize_path(current_working_dir)
-        
+
         # 定義儲存路徑
         save_dir = normalized_cwd / "tmp"
         # 建立 /tmp 資料夾 (如果不存在)
         save_dir.mkdir(parents=True, exist_ok=True)
-        
-        file_name = "screenshot.png"
+
+        file_name = f"{_file_stem(target)}.{FORMAT_EXTENSIONS[image_format]}"
         # file_path is now a Path object, and will be OS-specific
-        file_path_obj = save_dir / file_name
-
-        with mss.mss() as sct:
-            monitor = sct.monitors[1]  # 主螢幕
-            sct_img = sct.grab(monitor)
-            
-            # 將圖片儲存到檔案
-            # mss.tools.to_png expects a string path
-            mss.tools.to_png(sct_img.rgb, sct_img.size, output=str(file_path_obj))
-            
-            # 使用 Pillow 打開已儲存的圖片以獲取尺寸
-            with PillowImage.open(file_path_obj) as img:
-                width, height = img.size
-            
-            # 返回標準化的字串路徑
-            return ScreenCaptureInfo(file_path=str(file_path_obj), width=width, height=height)
+        file_path_obj: Path = save_dir / file_name
+        await run_in_capture_thread(_write_files, [(file_path_obj, encoded)])
+
+        # 返回標準化的字串路徑
+        info.file_path = str(file_path_obj)
+        return info, frame
     except Exception as e:
         print(f"Error capturing and saving screen: {e}")
         # 在錯誤情況下，可以考慮返回包含錯誤訊息的特定結構或引發異常
         # 為了保持返回類型一致，即使是錯誤也用模型結構，但可能包含錯誤標記
-        return ScreenCaptureInfo(file_path=f"Error: {str(e)}", width=0, height=0) 
\ No newline at end of file
+        return ScreenCaptureInfo(file_path=f"Error: {str(e)}", width=0, height=0), None
+
+async def _capture_changed_regions(current_working_dir: str, image_format: ImageFormat, png_compress_level: int,
+                                   quality: int, inline: bool, frame_timestamp: Optional[float],
+                                   tile_size: int, pixel_threshold: int,
+                                   target: CaptureTarget) -> tuple[ScreenCaptureInfo, Frame]:
+    global _last_frame
+    frame, regions, crops = await run_in_capture_thread(
+        _grab_and_diff, _last_frame, image_format, png_compress_level, quality,
+        frame_timestamp, tile_size, pixel_threshold, target,
+    )
+    _last_frame = frame
+
+    info = _info(frame, image_format, sum(len(c) for c in crops), target)
+    info.changed_regions = regions
+
+    if inline:
+        info.region_images_base64 = [base64.b64encode(c).decode("ascii") for c in crops]
+        return info, frame
+
+    changes_dir = _normalize_path(current_working_dir) / "tmp" / "changes"
+    changes_dir.mkdir(parents=True, exist_ok=True)
+    extension = FORMAT_EXTENSIONS[image_format]
+    paths_and_data = [
+        (changes_dir / f"change_x{r.x}_y{r.y}_w{r.width}_h{r.height}.{extension}", data)
+        for r, data in zip(regions, crops)
+    ]
+    await run_in_capture_thread(_write_files, paths_and_data, changes_dir)
+    info.region_paths = [str(path) for path, _ in paths_and_data]
+    return info, frame
+
+async def capture_screens(
+    current_working_dir: str,
+    targets: Optional[list[CaptureTarget]] = None,
+    image_format: ImageFormat = "png",
+    png_compress_level: int = 1,
+    quality: int = 85,
+    inline: bool = False,
+) -> list[ScreenCaptureInfo]:
+    """
+    Captures several targets (monitors, rectangles, windows) at once. Each target is grabbed and encoded
+    on its own thread of the parallel capture pool (MCP_CAPTURE_PARALLELISM, default 4), so the total time
+    is close to that of the slowest target instead of the sum.
+
+    Args:
+        current_working_dir: The current working directory; images are written to its 'tmp' folder, one file
+                             per target (screenshot_monitor2.png, screenshot_x10_y20_w400_h300.png, ...).
+        targets: What to capture; see CaptureTarget. Defaults to every monitor, each as a separate image.
+        image_format, png_compress_level, quality, inline: As in capture_screen.
+
+    Returns:
+        One ScreenCaptureInfo per target, in order, each with its own left/top/scale mapping to control_input
+        coordinates. A target that fails has file_path set to "Error: ..." and does not affect the others.
+        The frames are not kept as capture_screen's last frame; use the returned file paths.
+    """
+    try:
+        if targets is None:
+            monitors = await run_in_capture_thread(get_monitors)
+            targets = [CaptureTarget(monitor=index) for index in range(1, len(monitors))]
+        results = await run_in_capture_threads(
+            _grab_and_encode, [(image_format, png_compress_level, quality, None, target) for target in targets]
+        )
+    except Exception as e:
+        print(f"Error capturing screens: {e}", file=sys.stderr)
+        return [ScreenCaptureInfo(file_path=f"Error: {str(e)}", width=0, height=0)]
+
+    infos = []
+    paths_and_data = []
+    save_dir = None
+    for target, result in zip(targets, results):
+        if isinstance(result, Exception):
+            print(f"Error capturing {target}: {result}", file=sys.stderr)
+            infos.append(ScreenCaptureInfo(file_path=f"Error: {str(result)}", width=0, height=0))
+            continue
+        frame, encoded = result
+        info = _info(frame, image_format, len(encoded), target)
+        if inline:
+            info.image_base64 = base64.b64encode(encoded).decode("ascii")
+        else:
+            save_dir = save_dir or _normalize_path(current_working_dir) / "tmp"
+            path = save_dir / f"{_file_stem(target)}.{FORMAT_EXTENSIONS[image_format]}"
+            info.file_path = str(path)
+            paths_and_data.append((path, encoded))
+        infos.append(info)
+
+    if paths_and_data:
+        try:
+            save_dir.mkdir(parents=True, exist_ok=True)
+            await run_in_capture_thread(_write_files, paths_and_data)
+        except Exception as e:
+            print(f"Error saving screen captures: {e}", file=sys.stderr)
+            for info in infos:
+                if info.file_path and not info.file_path.startswith("Error"):
+                    info.file_path = f"Error: {str(e)}"
+    return infos
+
+async def list_monitors() -> list[MonitorInfo]:
+    """
+    Lists the monitors in screen coordinates (the ones control_input uses). Index 0 is the bounding box of
+    all monitors, 1 is the primary monitor; pass an index as capture_screen's monitor.
+    """
+    try:
+        monitors = await run_in_capture_thread(get_monitors)
+    except Exception as e:
+        print(f"Error listing monitors: {e}", file=sys.stderr) # stdout 是 MCP 的 stdio 通道
+        return []
+    return [
+        MonitorInfo(index=index, left=m["left"], top=m["top"], width=m["width"], height=m["height"])
+        for index, m in enumerate(monitors)
+    ]
@@ -1,80 +1,563 @@
-from google import genai # 更新導入方式以符合 Gemini API 快速入門的主要範例
 import os
 import io
+import sys
+import json
+import math
 # import base64 #不再需要，因為我們直接處理檔案路徑
 from PIL import Image as PillowImage # Pillow 用於圖片處理
+from PIL import ImageDraw, ImageFont
 # from mcp.server.fastmcp import Image as MCPImage # 不再直接用於函數簽名，改用下面的 ToolImageInput
-from pydantic import BaseModel # 導入 BaseModel
+from mcp.server.fastmcp import Context
+from pydantic import BaseModel, Field # 導入 BaseModel
 import asyncio # 新增導入 asyncio
 # import urllib.parse # For URL decoding path components - Moved to path_utils
 # import platform # To check OS - Moved to path_utils
 from pathlib import Path # For path manipulation
 # import re # Import re for regex matching - Moved to path_utils
+from typing import Literal, Optional, Union
 from utils.path_utils import _normalize_path
+from utils.perf_metrics import increment, span
+from utils.request_scheduler import SchedulerConfig, TokenBucket, call_with_retries, gather_bounded, get_status_code
+from utils.response_cache import disk_cache_dir, image_content_hash, perceptual_hash, response_cache_from_env
+from utils.result_progress import ResultProgress
+from utils.vision_backends import BackendResponse, DEFAULT_GEMINI_MODEL, ImagePart, resolve_model
 
-# 從環境變數讀取 API 金鑰。
-API_KEY = os.getenv("genaikey")
+# 模型呼叫透過 utils.vision_backends 進行：backend (Gemini 或 OpenAI 相容端點) 在第一次使用時
+# 才建立，整個行程共用同一個長駐的 HTTP 連線池。缺少 API 金鑰只會讓模型呼叫返回錯誤。
+MODEL_NAME = DEFAULT_GEMINI_MODEL # 預設模型，可用 GENAI_MODEL 或各工具的 model 參數覆寫
 
-if not API_KEY:
-    # 如果環境變數未設定，則拋出錯誤。
-    raise ValueError("Google API Key not found. Please set the 'genaikey' environment variable.")
+# 整個行程共用的速率限制器 (GENAI_REQUESTS_PER_MINUTE，0 表示不限制)
+_rate_limiter = TokenBucket(SchedulerConfig().requests_per_minute)
 
-# 注意：根據新的模式，不再需要 genai.configure(api_key=API_KEY)
-# Client 將在初始化時直接使用 API_KEY
-
-MODEL_NAME = "gemini-2.5-flash-preview-04-17" # 使用者指定的模型
+# 以 (模型, 提示, 圖片內容雜湊) 為鍵的回應快取 (GENAI_CACHE=0 可停用)
+_response_cache = response_cache_from_env()
 
 # 新定義的 Pydantic 模型，用於工具函數的圖片輸入參數
 class ToolImageInput(BaseModel):
     file_path: str
 
-async def generate_text_from_google(prompt: str, image_paths: list[str]) -> dict[str, str]:
-    """
-    使用 Google Generative AI 模型根據提供的文字提示和多個圖片檔案路徑生成文字。
-    對於每個圖片，都會獨立調用 client.aio.models.generate_content() 進行非同步操作。
+# 圖片來源：檔案路徑，或已在記憶體中的 Pillow 影像 (例如 get_subarea_description 的裁剪圖)
+ImageSource = Union[str, PillowImage.Image]
 
-    Args:
-        prompt: 要傳送給模型的通用文字提示 (將用於所有圖片)。
-        image_paths: 一個包含多個圖片檔案路徑 (str) 的列表。
+# Gemini 的圖片 token 計算：兩邊都不超過 384 px 時固定 258 tokens，
+# 否則切成 768x768 的 tile，每個 tile 258 tokens
+TOKENS_PER_IMAGE_TILE = 258
+SMALL_IMAGE_MAX_SIDE = 384
+IMAGE_TILE_SIZE = 768
 
-    Returns:
-        一個字典，鍵是原始輸入的圖片檔案路徑，值是模型對該圖片生成的回應文字。
-        如果某個圖片處理或API調用發生錯誤，對應的值將是錯誤訊息字串。
-    """
+class ImagePreprocessConfig(BaseModel):
+    """Settings for the preprocessing applied to every image before upload."""
+    max_dimension: Optional[int] = Field(default=None, description="Downscale so the longest side is at most this many pixels")
+    color_mode: Literal["original", "grayscale", "palette"] = Field(default="original", description="grayscale/palette shrink text-heavy UI screenshots")
+    palette_colors: int = Field(default=64, description="Number of colors used by color_mode='palette'")
+    encode_format: Literal["png", "jpeg", "webp"] = "png"
+    quality: int = Field(default=85, description="Quality (1-100) for jpeg/webp")
+    token_budget: Optional[int] = Field(default=None, description="Image-token budget for the whole call, split evenly across images; picks the resolution")
+
+    @classmethod
+    def from_env(cls) -> "ImagePreprocessConfig":
+        """Defaults from GENAI_IMAGE_* environment variables."""
+        max_dimension = os.getenv("GENAI_IMAGE_MAX_DIMENSION")
+        token_budget = os.getenv("GENAI_IMAGE_TOKEN_BUDGET")
+        return cls(
+            max_dimension=int(max_dimension) if max_dimension else None,
+            color_mode=os.getenv("GENAI_IMAGE_COLOR_MODE", "original"),
+            encode_format=os.getenv("GENAI_IMAGE_FORMAT", "png"),
+            quality=int(os.getenv("GENAI_IMAGE_QUALITY", "85")),
+            token_budget=int(token_budget) if token_budget else None,
+        )
+
+class ImageDescription(BaseModel):
+    text: str
+    error: bool = False
+    cached: bool = False
+    original_width: int = 0
+    original_height: int = 0
+    sent_width: int = 0
+    sent_height: int = 0
+    mime_type: str = ""
+    bytes_sent: int = 0 # 快取命中時為 0
+    estimated_tokens: int = 0
+    completed_ms: Optional[float] = None # 從呼叫開始到此結果完成的時間 (最小值即 time-to-first-result)
+    first_chunk_ms: Optional[float] = None # stream=True 時收到第一段文字的時間
+
+def estimate_image_tokens(width: int, height: int) -> int:
+    """Estimates the image tokens Gemini charges for an image of the given size."""
+    if width <= SMALL_IMAGE_MAX_SIDE and height <= SMALL_IMAGE_MAX_SIDE:
+        return TOKENS_PER_IMAGE_TILE
+    tiles = math.ceil(width / IMAGE_TILE_SIZE) * math.ceil(height / IMAGE_TILE_SIZE)
+    return tiles * TOKENS_PER_IMAGE_TILE
+
+def _fit_size(width: int, height: int, max_dimension: Optional[int], token_budget: Optional[int]) -> tuple[int, int]:
+    scale = 1.0
+    if max_dimension and max(width, height) > max_dimension:
+        scale = max_dimension / max(width, height)
+    if token_budget is not None:
+        if token_budget < 2 * TOKENS_PER_IMAGE_TILE:
+            # 預算只夠一個 tile：縮到 384 px 以內
+            scale = min(scale, SMALL_IMAGE_MAX_SIDE / max(width, height))
+        else:
+            while scale * max(width, height) > SMALL_IMAGE_MAX_SIDE and \
+                    estimate_image_tokens(round(width * scale), round(height * scale)) > token_budget:
+                scale *= 0.9
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+def _preprocess_image(image: PillowImage.Image, config: ImagePreprocessConfig,
+                      token_budget: Optional[int]) -> tuple[PillowImage.Image, bytes, str]:
+    """Downscales, reduces colors and re-encodes an image; returns (processed image, encoded bytes, mime type)."""
+    target_size = _fit_size(image.width, image.height, config.max_dimension, token_budget)
+    if target_size != image.size:
+        image = image.resize(target_size, PillowImage.Resampling.LANCZOS)
+
+    if config.color_mode == "grayscale":
+        image = image.convert("L")
+    elif config.color_mode == "palette":
+        image = image.convert("RGB").quantize(colors=config.palette_colors)
+    elif image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    buffer = io.BytesIO()
+    if config.encode_format == "png":
+        image.save(buffer, format="PNG", compress_level=1)
+    else:
+        if image.mode == "P":
+            image = image.convert("RGB")
+        image.save(buffer, format=config.encode_format.upper(), quality=config.quality)
+    return image, buffer.getvalue(), f"image/{config.encode_format}"
+
+def _load_and_prepare(source: Union[Path, PillowImage.Image], config: ImagePreprocessConfig,
+                      token_budget: Optional[int], with_hashes: bool
+                      ) -> tuple[bytes, str, ImageDescription, Optional[str], Optional[int]]:
+    with span("genai.preprocess"):
+        if isinstance(source, PillowImage.Image):
+            # 記憶體中的影像直接前處理，不經過檔案系統
+            original_size = source.size
+            processed, encoded, mime_type = _preprocess_image(source, config, token_budget)
+        else:
+            with PillowImage.open(source) as pil_image:
+                pil_image.load()
+                original_size = pil_image.size
+                processed, encoded, mime_type = _preprocess_image(pil_image, config, token_budget)
+        report = ImageDescription(
+            text="",
+            original_width=original_size[0],
+            original_height=original_size[1],
+            sent_width=processed.width,
+            sent_height=processed.height,
+            mime_type=mime_type,
+            bytes_sent=len(encoded),
+            estimated_tokens=estimate_image_tokens(processed.width, processed.height),
+        )
+        content_hash = phash = None
+        if with_hashes:
+            # 以處理後的影像計算雜湊，前處理設定不同時自然不會誤命中
+            content_hash = image_content_hash(processed)
+            phash = perceptual_hash(processed) if _response_cache.phash_max_distance > 0 else None
+        return encoded, mime_type, report, content_hash, phash
+
+async def _generate_descriptions(
+    prompt: str,
+    images: dict[str, ImageSource],
+    max_concurrency: Optional[int],
+    use_cache: bool,
+    preprocess: Optional[ImagePreprocessConfig],
+    model: Optional[str] = None,
+    stream: bool = False,
+    progress: Optional[ResultProgress] = None,
+    current_working_dir: Optional[str] = None,
+) -> dict[str, ImageDescription]:
     results = {}
+    model_label = model or MODEL_NAME
+    progress = progress or ResultProgress(total=len(images))
+    config = SchedulerConfig(max_concurrency=max_concurrency)
+    cache = _response_cache if use_cache else None
+    cache_dir = disk_cache_dir(current_working_dir)
+    preprocess = preprocess or ImagePreprocessConfig.from_env()
+    per_image_budget = preprocess.token_budget // max(len(images), 1) if preprocess.token_budget else None
     try:
-        client = genai.Client(api_key=API_KEY)
+        backend, model_name = resolve_model(model)
+        model_label = f"{backend.name}:{model_name}" # 也作為快取鍵，不同 backend 的回答分開快取
+
+        async def describe_and_report(original_image_path_str: str) -> ImageDescription:
+            # 每張圖片完成時立即回報，不必等待其餘圖片
+            report = await describe_image(original_image_path_str)
+            report.completed_ms = await progress.result(original_image_path_str, report.text)
+            return report
+
+        async def stream_response(key: str, content_parts: list, report: ImageDescription) -> BackendResponse:
+            chunks = [] # 重試時重新開始
+            async for chunk in backend.generate_stream(model_name, content_parts):
+                if not chunk:
+                    continue
+                if report.first_chunk_ms is None:
+                    report.first_chunk_ms = progress.elapsed_ms()
+                chunks.append(chunk)
+                await progress.partial(key, "".join(chunks))
+            return BackendResponse("".join(chunks))
 
-        for original_image_path_str in image_paths:
+        async def describe_image(original_image_path_str: str) -> ImageDescription:
             normalized_path_for_opening = None
             try:
-                normalized_path_for_opening = _normalize_path(original_image_path_str)
-                pil_image = PillowImage.open(normalized_path_for_opening)
-                content_parts = [prompt, pil_image]
-                
-                # 使用 client.aio.models.generate_content() 進行非同步操作
-                response = await client.aio.models.generate_content(
-                    model=MODEL_NAME,
-                    contents=content_parts
+                source = images[original_image_path_str]
+                if isinstance(source, str):
+                    source = normalized_path_for_opening = _normalize_path(source)
+                # 讀檔、前處理、編碼與雜湊都不在 event loop 上進行
+                encoded, mime_type, report, content_hash, phash = await asyncio.to_thread(
+                    _load_and_prepare, source, preprocess, per_image_budget, cache is not None
                 )
-                results[original_image_path_str] = response.text # 使用原始路徑作為鍵
+                if cache is not None:
+                    cached_text = await asyncio.to_thread(cache.get, model_label, prompt, content_hash, phash, cache_dir)
+                    if cached_text is not None:
+                        increment("genai.cache_hits")
+                        report.text, report.cached, report.bytes_sent = cached_text, True, 0
+                        return report
+                    increment("genai.cache_misses")
+                content_parts = [prompt, ImagePart(encoded, mime_type)]
+
+                # 模型延遲 (含重試與速率限制的等待)
+                with span("genai.model"):
+                    if stream:
+                        response = await call_with_retries(
+                            lambda: stream_response(original_image_path_str, content_parts, report),
+                            config,
+                            _rate_limiter,
+                        )
+                    else:
+                        response = await call_with_retries(
+                            lambda: backend.generate(model_name, content_parts),
+                            config,
+                            _rate_limiter,
+                        )
+                increment("genai.requests")
+                increment("genai.bytes_sent", report.bytes_sent)
+                if cache is not None and response.text is not None:
+                    await asyncio.to_thread(cache.put, model_label, prompt, content_hash, response.text, phash, cache_dir)
+                report.text = response.text
+                # stdout 是 MCP 的 stdio 通道，記錄訊息寫到 stderr
+                print(f"Sent {original_image_path_str}: {report.sent_width}x{report.sent_height} {mime_type}, "
+                      f"{report.bytes_sent} bytes, ~{report.estimated_tokens} image tokens", file=sys.stderr)
+                return report
             except FileNotFoundError:
                 error_msg = f"Error: Image file not found at {normalized_path_for_opening if normalized_path_for_opening else original_image_path_str}"
                 print(error_msg)
-                results[original_image_path_str] = error_msg
+                return ImageDescription(text=error_msg, error=True)
             except Exception as e:
                 error_msg = f"Error processing image {normalized_path_for_opening if normalized_path_for_opening else original_image_path_str} or calling API: {type(e).__name__} - {str(e)}"
                 print(error_msg)
-                results[original_image_path_str] = error_msg
-        
+                return ImageDescription(text=error_msg, error=True)
+
+        # 結果仍以原始路徑作為鍵
+        results = await gather_bounded(list(images), describe_and_report, config.max_concurrency)
         return results
 
     except Exception as e:
         # 捕獲 client 初始化或其他未預期的頂層錯誤
-        print(f"General error in generate_text_from_google (model: {MODEL_NAME}): {type(e).__name__} - {e}")
+        print(f"General error in generate_text_from_google (model: {model_label}): {type(e).__name__} - {e}")
         error_details = str(e)
         # 為所有請求的圖片路徑填充一個通用錯誤，因為無法進行個別處理
-        for original_image_path_str in image_paths:
+        for original_image_path_str in images:
             if original_image_path_str not in results: # 避免覆蓋已有的個別錯誤
-                 results[original_image_path_str] = f"General error during API call setup (model: {MODEL_NAME}): {type(e).__name__} - {error_details}"
-        return results 
\ No newline at end of file
+                 results[original_image_path_str] = ImageDescription(
+                     text=f"General error during API call setup (model: {model_label}): {type(e).__name__} - {error_details}",
+                     error=True,
+                 )
+        return results
+
+async def generate_text_from_google(
+    prompt: str,
+    image_paths: list[str],
+    max_concurrency: Optional[int] = None,
+    use_cache: bool = True,
+    preprocess: Optional[ImagePreprocessConfig] = None,
+    model: Optional[str] = None,
+    stream: bool = False,
+    current_working_dir: Optional[str] = None,
+    ctx: Context = None
+) -> dict[str, str]:
+    """
+    使用 Google Generative AI 模型根據提供的文字提示和多個圖片檔案路徑生成文字。
+    對於每個圖片，都會獨立送出一個非同步的模型請求 (透過整個行程共用、重用連線的 backend client)，
+    各圖片的請求會並行送出 (受並行上限與每分鐘請求數限制)，429/5xx 與逾時會以指數退避重試。
+    圖片上傳前會依 preprocess 設定縮小、減色並重新編碼。
+    每張圖片完成時會立即以 MCP 進度通知送出其路徑、耗時與回應文字，不必等待最慢的圖片；
+    第一個結果的時間 (time-to-first-result) 會被記錄。
+
+    Args:
+        prompt: 要傳送給模型的通用文字提示 (將用於所有圖片)。
+        image_paths: 一個包含多個圖片檔案路徑 (str) 的列表。
+        max_concurrency: 同時進行中的請求上限，預設取自 GENAI_MAX_CONCURRENCY (8)。
+        use_cache: 是否使用回應快取。相同模型、提示與圖片內容 (或感知雜湊相近的圖片) 會直接返回先前的回應。
+        preprocess: 上傳前的圖片前處理設定 (最大邊長、灰階/調色盤、編碼格式、token 預算)。
+                    未提供時使用 GENAI_IMAGE_* 環境變數，預設為原尺寸 PNG。
+        model: 本次呼叫使用的模型。可加上 backend 前綴 (例如 "openai:gpt-4o"、"gemini:gemini-2.0-flash")；
+               未提供時使用 GENAI_BACKEND 的預設模型 (Gemini 為 GENAI_MODEL 或 gemini-2.5-flash-preview-04-17)。
+        stream: 使用模型的串流 API；目前為止收到的文字會以 log 通知 ("[partial] 路徑: 文字") 陸續送出。
+        current_working_dir: 工作目錄；啟用磁碟快取 (GENAI_DISK_CACHE=1) 時，快取存放在其下的 tmp/genai_cache。
+
+    Returns:
+        一個字典，鍵是原始輸入的圖片檔案路徑，值是模型對該圖片生成的回應文字。
+        如果某個圖片處理或API調用發生錯誤，對應的值將是錯誤訊息字串。
+    """
+    images = {path: path for path in image_paths}
+    progress = ResultProgress(ctx, total=len(images))
+    descriptions = await _generate_descriptions(prompt, images, max_concurrency, use_cache, preprocess, model, stream, progress,
+                                                current_working_dir)
+    return {path: description.text for path, description in descriptions.items()}
+
+async def generate_text_from_google_with_stats(
+    prompt: str,
+    image_paths: list[str],
+    max_concurrency: Optional[int] = None,
+    use_cache: bool = True,
+    preprocess: Optional[ImagePreprocessConfig] = None,
+    model: Optional[str] = None,
+    stream: bool = False,
+    current_working_dir: Optional[str] = None,
+    ctx: Context = None
+) -> dict[str, ImageDescription]:
+    """
+    與 generate_text_from_google 相同，但每個圖片除了回應文字外，還會返回實際送出的尺寸、
+    位元組數、估計的圖片 token 數、是否命中快取，以及從呼叫開始到該結果完成的時間 (completed_ms)
+    與串流時收到第一段文字的時間 (first_chunk_ms)，方便在成本、延遲與準確度之間調整設定。
+    """
+    images = {path: path for path in image_paths}
+    progress = ResultProgress(ctx, total=len(images))
+    return await _generate_descriptions(prompt, images, max_concurrency, use_cache, preprocess, model, stream, progress,
+                                        current_working_dir)
+
+async def describe_images(
+    prompt: str,
+    images: dict[str, ImageSource],
+    max_concurrency: Optional[int] = None,
+    use_cache: bool = True,
+    preprocess: Optional[ImagePreprocessConfig] = None,
+    model: Optional[str] = None,
+    stream: bool = False,
+    progress: Optional[ResultProgress] = None,
+    current_working_dir: Optional[str] = None
+) -> dict[str, str]:
+    """
+    Python-level variant of generate_text_from_google for callers that already hold the images:
+    values may be file paths or in-memory Pillow images, and results are keyed like images.
+    Pass a ResultProgress to have each result forwarded as soon as it is ready, and the caller's
+    current_working_dir to place the disk cache tier under its tmp folder.
+    """
+    descriptions = await _generate_descriptions(prompt, images, max_concurrency, use_cache, preprocess, model, stream, progress,
+                                                current_working_dir)
+    return {key: description.text for key, description in descriptions.items()}
+
+# --- 批次模式：多張圖片在同一個請求中描述 ---
+BatchMode = Literal["multi_image", "contact_sheet"]
+CONTACT_SHEET_MAX_SIDE = 1536
+CONTACT_SHEET_LABEL_HEIGHT = 22
+
+class _LabelledDescription(BaseModel):
+    label: str
+    description: str
+
+class BatchLimits:
+    """
+    Per-request limits used to size batches. Defaults can be overridden with GENAI_BATCH_* variables.
+    The limits are static: they are the same for every backend and model. A request that a model
+    still rejects as too large is split in half at call time.
+    """
+
+    def __init__(self):
+        self.max_images = int(os.getenv("GENAI_BATCH_MAX_IMAGES", "16"))
+        self.max_image_tokens = int(os.getenv("GENAI_BATCH_MAX_IMAGE_TOKENS", "32000"))
+        # Gemini 的 inline 請求總大小上限約 20 MB，預留 base64 與提示的空間
+        self.max_request_bytes = int(os.getenv("GENAI_BATCH_MAX_REQUEST_BYTES", str(14 * 1024 * 1024)))
+
+def _plan_batches(items: list[tuple[str, ImageDescription]], limits: BatchLimits) -> list[list[str]]:
+    """Greedily packs images into batches that respect the image-count, token and byte limits."""
+    batches, current, tokens, size = [], [], 0, 0
+    for key, report in items:
+        if current and (len(current) >= limits.max_images
+                        or tokens + report.estimated_tokens > limits.max_image_tokens
+                        or size + report.bytes_sent > limits.max_request_bytes):
+            batches.append(current)
+            current, tokens, size = [], 0, 0
+        current.append(key)
+        tokens += report.estimated_tokens
+        size += report.bytes_sent
+    if current:
+        batches.append(current)
+    return batches
+
+def _batch_label(index: int) -> str:
+    return f"R{index + 1}"
+
+def _build_contact_sheet(images: list[PillowImage.Image], labels: list[str]) -> PillowImage.Image:
+    """Tiles images into one labelled grid; each cell keeps its image's aspect ratio."""
+    columns = math.ceil(math.sqrt(len(images)))
+    rows = math.ceil(len(images) / columns)
+    # 格子大小依最大的圖片決定，但整張 sheet 不超過 CONTACT_SHEET_MAX_SIDE
+    cell_width = min(max(image.width for image in images) + 4, CONTACT_SHEET_MAX_SIDE // columns)
+    cell_height = min(max(image.height for image in images) + CONTACT_SHEET_LABEL_HEIGHT + 4,
+                      CONTACT_SHEET_MAX_SIDE // rows)
+    sheet = PillowImage.new("RGB", (cell_width * columns, cell_height * rows), "white")
+    draw = ImageDraw.Draw(sheet)
+    font = ImageFont.load_default(size=16)
+    for index, (image, label) in enumerate(zip(images, labels)):
+        left = (index % columns) * cell_width
+        top = (index // columns) * cell_height
+        tile = image.convert("RGB")
+        tile.thumbnail((cell_width - 4, cell_height - CONTACT_SHEET_LABEL_HEIGHT - 4), PillowImage.Resampling.LANCZOS)
+        draw.rectangle([left, top, left + cell_width - 1, top + CONTACT_SHEET_LABEL_HEIGHT], fill="black")
+        draw.text((left + 4, top + 2), label, fill="yellow", font=font)
+        sheet.paste(tile, (left + 2, top + CONTACT_SHEET_LABEL_HEIGHT + 2))
+        draw.rectangle([left, top, left + cell_width - 1, top + cell_height - 1], outline="red")
+    return sheet
+
+def _batch_prompt(prompt: str, labels: list[str], mode: BatchMode) -> str:
+    if mode == "contact_sheet":
+        layout = (f"The image is a contact sheet of {len(labels)} separate panels separated by red borders. "
+                  f"Each panel has its label ({', '.join(labels)}) in the black banner above it.")
+    else:
+        layout = f"You are given {len(labels)} separate images, each preceded by its label ({', '.join(labels)})."
+    return (f"{prompt}\n\n{layout} Answer the request above independently for each one, looking only at that "
+            f"panel/image. Return a JSON array with exactly one object per label: "
+            f'{{"label": <label>, "description": <your answer for that image>}}.')
+
+def _parse_batch_response(response, labels: list[str]) -> dict[str, str]:
+    parsed = getattr(response, "parsed", None)
+    if parsed is None:
+        parsed = [_LabelledDescription(**item) for item in json.loads(response.text)]
+    answers = {item.label.strip(): item.description for item in parsed}
+    return {label: answers[label] for label in labels if label in answers}
+
+async def generate_batched_text_from_google(
+    prompt: str,
+    images: dict[str, ImageSource],
+    mode: BatchMode = "multi_image",
+    use_cache: bool = True,
+    preprocess: Optional[ImagePreprocessConfig] = None,
+    max_concurrency: Optional[int] = None,
+    model: Optional[str] = None,
+    progress: Optional[ResultProgress] = None,
+    current_working_dir: Optional[str] = None,
+) -> dict[str, str]:
+    """
+    Describes several images with as few model requests as possible.
+
+    mode="multi_image" sends every image of a batch in one request; mode="contact_sheet" tiles
+    them into a single labelled image. The model answers with a JSON array (structured output)
+    of {label, description}, which is split back into a dict keyed like images (values may be file
+    paths or in-memory Pillow images).
+    Batches are sized by the static BatchLimits (image count, image tokens, request bytes), which do not
+    depend on the model; a batch the API rejects as too large is split in half instead. Images missing
+    from a batch answer fall back to individual requests through describe_images.
+    preprocess.token_budget is split evenly across the images, as in describe_images.
+    Each batch's answers are forwarded through progress as soon as that batch completes.
+    """
+    results: dict[str, str] = {}
+    progress = progress or ResultProgress(total=len(images))
+    config = SchedulerConfig(max_concurrency=max_concurrency)
+    cache = _response_cache if use_cache else None
+    cache_dir = disk_cache_dir(current_working_dir)
+    model_label = model or MODEL_NAME
+    preprocess = preprocess or ImagePreprocessConfig.from_env()
+    limits = BatchLimits()
+    per_image_budget = preprocess.token_budget // max(len(images), 1) if preprocess.token_budget else None
+
+    prepared: dict[str, tuple[bytes, str, ImageDescription, Optional[str], Optional[int]]] = {}
+    for path, source in images.items():
+        try:
+            if isinstance(source, str):
+                source = _normalize_path(source)
+            prepared[path] = await asyncio.to_thread(
+                _load_and_prepare, source, preprocess, per_image_budget, cache is not None
+            )
+        except Exception as e:
+            results[path] = f"Error processing image {path}: {type(e).__name__} - {str(e)}"
+            print(results[path], file=sys.stderr)
+
+    try:
+        backend, model_name = resolve_model(model)
+    except Exception as e:
+        for path in prepared:
+            results[path] = f"General error during API call setup (model: {model_label}): {type(e).__name__} - {str(e)}"
+        return results
+    cache_model = f"{backend.name}:{model_name}#{mode}"  # 批次回答與單張回答分開快取
+
+    pending = []
+    for path, (_, _, report, content_hash, phash) in prepared.items():
+        if cache is not None:
+            cached_text = await asyncio.to_thread(cache.get, cache_model, prompt, content_hash, phash, cache_dir)
+            if cached_text is not None:
+                increment("genai.cache_hits")
+                results[path] = cached_text
+                await progress.result(path, cached_text)
+                continue
+            increment("genai.cache_misses")
+        pending.append((path, report))
+
+    fallback_paths: list[str] = []
+
+    async def run_batch(batch: list[str]) -> None:
+        labels = [_batch_label(i) for i in range(len(batch))]
+        if mode == "contact_sheet":
+            images = [PillowImage.open(io.BytesIO(prepared[path][0])) for path in batch]
+            with span("genai.contact_sheet"):
+                sheet = await asyncio.to_thread(_build_contact_sheet, images, labels)
+                buffer = io.BytesIO()
+                await asyncio.to_thread(sheet.save, buffer, "PNG", compress_level=1)
+            content_parts = [_batch_prompt(prompt, labels, mode),
+                             ImagePart(buffer.getvalue(), "image/png")]
+        else:
+            content_parts = [_batch_prompt(prompt, labels, mode)]
+            for label, path in zip(labels, batch):
+                encoded, mime_type = prepared[path][0], prepared[path][1]
+                content_parts += [f"{label}:", ImagePart(encoded, mime_type)]
+        try:
+            with span("genai.batch_model"):
+                response = await call_with_retries(
+                    lambda: backend.generate(model_name, content_parts, response_schema=list[_LabelledDescription]),
+                    config,
+                    _rate_limiter,
+                )
+            increment("genai.requests")
+            increment("genai.bytes_sent", sum(len(part.data) for part in content_parts if isinstance(part, ImagePart)))
+            answers = _parse_batch_response(response, labels)
+        except Exception as e:
+            if get_status_code(e) in (400, 413) and len(batch) > 1:
+                # 請求過大：對半切分後重試
+                middle = len(batch) // 2
+                await asyncio.gather(run_batch(batch[:middle]), run_batch(batch[middle:]))
+                return
+            print(f"Batched request failed ({type(e).__name__} - {e}); falling back to individual requests", file=sys.stderr)
+            fallback_paths.extend(batch)
+            return
+        for label, path in zip(labels, batch):
+            if label not in answers:
+                fallback_paths.append(path)
+                continue
+            results[path] = answers[label]
+            await progress.result(path, answers[label])
+            if cache is not None:
+                _, _, _, content_hash, phash = prepared[path]
+                await asyncio.to_thread(cache.put, cache_model, prompt, content_hash, answers[label], phash, cache_dir)
+
+    batches = _plan_batches(pending, limits)
+    await gather_bounded(list(range(len(batches))), lambda i: run_batch(batches[i]), config.max_concurrency)
+
+    if fallback_paths:
+        fallback_images = {path: images[path] for path in fallback_paths}
+        results.update(await describe_images(prompt, fallback_images, max_concurrency, use_cache, preprocess, model,
+                                             progress=progress, current_working_dir=current_working_dir))
+    return results
+
+async def get_genai_cache_stats() -> dict:
+    """
+    Returns hit/miss counters of the vision response cache used by
+    generate_text_from_google and get_subarea_description.
+    """
+    if _response_cache is None:
+        return {"enabled": False}
+    stats = _response_cache.stats.as_dict()
+    disk_dir = None
+    if os.getenv("GENAI_DISK_CACHE", "0") == "1":
+        # 未設定 GENAI_CACHE_DIR 時位置取決於每次呼叫的工作目錄
+        disk_dir = os.getenv("GENAI_CACHE_DIR") or "<current_working_dir>/tmp/genai_cache"
+    stats.update(enabled=True, entries=len(_response_cache), disk_dir=disk_dir)
+    return stats
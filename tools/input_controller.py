@@ -1,121 +1,402 @@
-import pyautogui
+import asyncio
+import threading
+import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from mcp.server.fastmcp import Context
+from PIL import Image as PillowImage
 from pydantic import BaseModel, Field
-from typing import List, Optional, Union, Literal
+from typing import List, NamedTuple, Optional, Union, Literal
+from utils.bounds import SubAreaBounds
+from utils.frame_diff import changed_pixel_fraction
+from utils.path_utils import _normalize_path
+from utils.perf_metrics import increment, record, span
+from utils.screen_grabber import grab_monitor, grab_region, run_in_capture_thread
 
-# --- PyAutoGUI 設定 (可以根據需要調整) ---
-pyautogui.FAILSAFE = True # 滑鼠移到左上角觸發 FailSafeException
-pyautogui.PAUSE = 0.1     # 每個 pyautogui 函數呼叫後的預設暫停時間
+# pyautogui 在第一次執行指令時才於輸入執行緒上載入 (見 _load_pyautogui)：
+# 匯入它需要連線到顯示伺服器，不應拖慢或中斷伺服器啟動
+pyautogui = None
+# pyautogui.PAUSE (每個 pyautogui 函數呼叫後的暫停時間) 由每個批次的延遲設定檔決定，見 _PROFILES
+
+InputProfile = Literal["instant", "default", "human"]
+
+class _LatencyProfile(NamedTuple):
+    pause: float                  # 每個 pyautogui 呼叫後的暫停 (秒)
+    min_duration: float           # 滑鼠移動/拖曳時間的下限
+    max_duration: Optional[float] # 滑鼠移動/拖曳時間的上限，None 表示沿用指令的 duration
+    type_interval: float          # 'type' 每個字元之間的間隔
+
+_PROFILES: dict[str, _LatencyProfile] = {
+    "instant": _LatencyProfile(pause=0.0, min_duration=0.0, max_duration=0.0, type_interval=0.0),
+    "default": _LatencyProfile(pause=0.1, min_duration=0.0, max_duration=None, type_interval=0.01),
+    "human": _LatencyProfile(pause=0.25, min_duration=0.4, max_duration=None, type_interval=0.06),
+}
 
 # --- Pydantic 模型定義指令結構 ---
 class Command(BaseModel):
     action: Literal[
         "click", "double_click", "right_click", "middle_click", 
-        "type", "press", "hotkey",
+        "type", "paste_text", "press", "hotkey",
         "move_to", "drag_to", 
         "scroll", 
-        "wait"
+        "wait", "wait_until_stable", "wait_until_changed", "wait_for_region_match"
     ]
     x: Optional[int] = None
     y: Optional[int] = None
     text: Optional[str] = None
+    paste_method: Optional[Literal["clipboard", "burst"]] = Field(default="clipboard", description="How 'paste_text' inserts text: clipboard + paste hotkey, or one burst of key events")
     keys: Optional[Union[str, List[str]]] = None # 單個鍵或多個鍵列表
     duration: Optional[float] = Field(default=0.2, description="Duration in seconds for mouse movements/drags")
     button: Optional[Literal["left", "middle", "right"]] = "left"
     clicks: Optional[int] = 1
     scroll_amount: Optional[int] = None # 正數向上，負數向下
     wait_time: Optional[float] = Field(default=1.0, description="Duration in seconds for wait action")
+    # 以下欄位用於條件等待 (wait_until_stable / wait_until_changed / wait_for_region_match)
+    region: Optional[SubAreaBounds] = Field(default=None, description="Screen region to watch (screen coordinates); defaults to the primary monitor")
+    timeout: Optional[float] = Field(default=10.0, description="Maximum seconds to wait for the condition")
+    poll_interval: Optional[float] = Field(default=0.1, description="Seconds between region grabs")
+    stable_time: Optional[float] = Field(default=0.5, description="How long the region must stay unchanged for wait_until_stable")
+    pixel_threshold: Optional[int] = Field(default=8, description="Per-channel difference treated as noise")
+    change_fraction: Optional[float] = Field(default=0.001, description="Fraction of differing pixels that counts as a change (or the tolerated mismatch for wait_for_region_match)")
+    reference_image_path: Optional[str] = Field(default=None, description="Image the region must match for wait_for_region_match")
+    fail_on_timeout: Optional[bool] = Field(default=True, description="Stop the batch with an error if the condition is not met in time")
     comment: Optional[str] = None # 用於使用者註釋，不影響執行
 
+class WaitResult(BaseModel):
+    command_index: int
+    action: str
+    satisfied: bool
+    waited_ms: float # 實際等待的時間
+    polls: int # 擷取區域的次數
+    change_fraction: Optional[float] = None # 最後一次比較時不同像素的比例
+
 class InputControlResult(BaseModel):
-    status: Literal["success", "error"]
+    status: Literal["success", "error", "cancelled"]
     message: str
     last_executed_command_index: Optional[int] = None
+    completed_at: Optional[float] = None # 指令結束時間 (time.time())，可作為 capture_screen 的 frame_timestamp
+    command_timings_ms: list[float] = [] # 每個已執行指令的實際耗時 (毫秒)
+    wait_results: list[WaitResult] = [] # 每個條件等待指令的結果
+
+# 所有 pyautogui 呼叫都在這個專用的輸入執行緒上依序執行 (executor 的佇列即指令佇列)，
+# 不會阻塞 MCP 的 event loop，擷取與模型呼叫可以同時進行
+_input_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="input")
+
+# 一次只執行一個批次；等待中的批次也在 _active_cancel_events 中，可以在開始前被取消
+_batch_lock = asyncio.Lock()
+
+# 進行中批次的取消旗標；cancel_control_input 會設定所有旗標
+_active_cancel_events: set[threading.Event] = set()
+
+# 長字串分段輸入，讓取消可以在輸入途中生效
+_TYPE_CHUNK_SIZE = 32
+
+# paste_text 送出貼上快捷鍵後，等待這麼多秒再還原剪貼簿 (貼上由目標程式非同步處理)
+_CLIPBOARD_RESTORE_DELAY = 0.15
+
+class _CommandError(Exception):
+    """A command that cannot run because of missing or invalid parameters."""
+
+class _FailSafeTriggered(Exception):
+    """pyautogui's fail-safe fired (mouse moved to a screen corner)."""
+
+def _load_pyautogui():
+    global pyautogui
+    if pyautogui is None:
+        import pyautogui as module
+        # --- PyAutoGUI 設定 (可以根據需要調整) ---
+        module.FAILSAFE = True # 滑鼠移到左上角觸發 FailSafeException
+        pyautogui = module
+    return pyautogui
+
+def _movement_duration(cmd: Command, profile: _LatencyProfile) -> float:
+    duration = max(cmd.duration or 0.0, profile.min_duration)
+    if profile.max_duration is not None:
+        duration = min(duration, profile.max_duration)
+    return duration
+
+def _paste_text(text: str, method: str) -> None:
+    if method == "clipboard":
+        try:
+            import pyperclip # pyautogui 的相依套件
+            previous = pyperclip.paste()
+            pyperclip.copy(text)
+        except (ImportError, RuntimeError) as e: # PyperclipException 是 RuntimeError 的子類別
+            # 沒有可用的剪貼簿 (例如缺少 xclip/xsel) 時改用按鍵事件
+            print(f"Clipboard paste unavailable ({e}), falling back to key-event burst", file=sys.stderr)
+        else:
+            try:
+                pyautogui.hotkey("command" if sys.platform == "darwin" else "ctrl", "v")
+            finally:
+                # 等目標程式讀取剪貼簿後，再還原使用者原本的剪貼簿內容
+                time.sleep(_CLIPBOARD_RESTORE_DELAY)
+                pyperclip.copy(previous)
+            return
+    pyautogui.write(text, interval=0) # 一次送出所有按鍵事件，只在結尾暫停一次
+
+def _execute_command(i: int, cmd: Command, cancel_event: threading.Event, profile: _LatencyProfile) -> None:
+    """Runs one command on the input thread. Raises _CommandError for invalid parameters."""
+    _load_pyautogui()
+    try:
+        # 只量測 pyautogui 的執行時間 (不含在輸入執行緒前排隊的時間)
+        with span(f"input.{cmd.action}"):
+            _run_action(i, cmd, cancel_event, profile)
+    except pyautogui.FailSafeException as e:
+        increment("input.failsafe")
+        raise _FailSafeTriggered() from e
+
+def _run_action(i: int, cmd: Command, cancel_event: threading.Event, profile: _LatencyProfile) -> None:
+    # 所有 pyautogui 呼叫都只在輸入執行緒上依序執行，因此在這裡設定全域 PAUSE 不會影響其他批次
+    pyautogui.PAUSE = profile.pause
+    duration = _movement_duration(cmd, profile)
+    if cmd.action == "click":
+        if cmd.x is not None and cmd.y is not None:
+            pyautogui.click(x=cmd.x, y=cmd.y, clicks=cmd.clicks, button=cmd.button, duration=duration)
+        else:
+            pyautogui.click(clicks=cmd.clicks, button=cmd.button, duration=duration) # 點擊目前位置
+    elif cmd.action == "double_click":
+         if cmd.x is not None and cmd.y is not None:
+            pyautogui.doubleClick(x=cmd.x, y=cmd.y, button=cmd.button, duration=duration)
+         else:
+            pyautogui.doubleClick(button=cmd.button, duration=duration)
+    elif cmd.action == "right_click":
+        if cmd.x is not None and cmd.y is not None:
+            pyautogui.rightClick(x=cmd.x, y=cmd.y, duration=duration)
+        else:
+            pyautogui.rightClick(duration=duration)
+    elif cmd.action == "middle_click":
+        if cmd.x is not None and cmd.y is not None:
+            pyautogui.middleClick(x=cmd.x, y=cmd.y, duration=duration)
+        else:
+            pyautogui.middleClick(duration=duration)
+    elif cmd.action == "type":
+        if cmd.text is not None:
+            for start in range(0, len(cmd.text), _TYPE_CHUNK_SIZE):
+                if cancel_event.is_set():
+                    return
+                # 只在最後一個分段之後暫停 PAUSE，分段不會增加整體延遲
+                last_chunk = start + _TYPE_CHUNK_SIZE >= len(cmd.text)
+                pyautogui.typewrite(cmd.text[start:start + _TYPE_CHUNK_SIZE], interval=profile.type_interval,
+                                    _pause=last_chunk)
+        else:
+            raise _CommandError(f"Command {i} ('type') missing 'text' parameter.")
+    elif cmd.action == "paste_text":
+        if cmd.text is not None:
+            _paste_text(cmd.text, cmd.paste_method or "clipboard")
+        else:
+            raise _CommandError(f"Command {i} ('paste_text') missing 'text' parameter.")
+    elif cmd.action == "press":
+        if cmd.keys is not None:
+            if isinstance(cmd.keys, list):
+                for key in cmd.keys: # pyautogui.press 不直接支援列表，需逐個按
+                    pyautogui.press(key)
+            else:
+                pyautogui.press(cmd.keys)
+        else:
+            raise _CommandError(f"Command {i} ('press') missing 'keys' parameter.")
+    elif cmd.action == "hotkey":
+        if cmd.keys is not None and isinstance(cmd.keys, list):
+            pyautogui.hotkey(*cmd.keys) # hotkey 接受多個參數
+        elif cmd.keys is not None and isinstance(cmd.keys, str):
+             pyautogui.hotkey(cmd.keys) # 也可接受單個字串代表的組合鍵，如 'ctrl+c'
+        else:
+            raise _CommandError(f"Command {i} ('hotkey') missing 'keys' parameter or keys not a list/str.")
+    elif cmd.action == "move_to":
+        if cmd.x is not None and cmd.y is not None:
+            pyautogui.moveTo(cmd.x, cmd.y, duration=duration)
+        else:
+            raise _CommandError(f"Command {i} ('move_to') missing 'x' or 'y' parameters.")
+    elif cmd.action == "drag_to":
+        if cmd.x is not None and cmd.y is not None:
+            pyautogui.dragTo(cmd.x, cmd.y, duration=duration, button=cmd.button)
+        else:
+            raise _CommandError(f"Command {i} ('drag_to') missing 'x' or 'y' parameters.")
+    elif cmd.action == "scroll":
+        if cmd.scroll_amount is not None:
+            pyautogui.scroll(cmd.scroll_amount)
+        else:
+            raise _CommandError(f"Command {i} ('scroll') missing 'scroll_amount' parameter.")
+    else:
+        raise _CommandError(f"Unknown action type '{cmd.action}' at command {i}.")
+
+async def _sleep_unless_cancelled(seconds: float, cancel_event: threading.Event) -> None:
+    # 非阻塞的等待，每 50 ms 檢查一次取消旗標
+    deadline = time.monotonic() + seconds
+    while not cancel_event.is_set():
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        await asyncio.sleep(min(remaining, 0.05))
+
+_CONDITION_WAITS = ("wait_until_stable", "wait_until_changed", "wait_for_region_match")
+
+def _grab_watch_region(region: Optional[SubAreaBounds]) -> np.ndarray:
+    frame = grab_monitor(1) if region is None else grab_region(region.x, region.y, region.width, region.height)
+    return frame.as_array()
 
-async def control_input(commands: List[Command]) -> InputControlResult:
+def _load_reference(path: str, region: Optional[SubAreaBounds]) -> np.ndarray:
+    with PillowImage.open(_normalize_path(path)) as image:
+        rgb = image.convert("RGB")
+    # 縮放到實際擷取的尺寸：grab_region 返回實體像素，顯示縮放比例不是 1 時與 region 的邏輯尺寸不同
+    height, width = _grab_watch_region(region).shape[:2]
+    if rgb.size != (width, height):
+        rgb = rgb.resize((width, height), PillowImage.Resampling.BILINEAR)
+    return np.asarray(rgb)[..., ::-1] # 轉為 BGR，與擷取結果的通道順序一致
+
+def _poll_region(region: Optional[SubAreaBounds], compare_to: Optional[np.ndarray],
+                 pixel_threshold: int) -> tuple[np.ndarray, Optional[float]]:
+    # 擷取與比較都在擷取執行緒上進行，大區域的逐像素比較不會阻塞 event loop
+    current = _grab_watch_region(region)
+    if compare_to is None:
+        return current, None
+    return current, changed_pixel_fraction(compare_to, current, pixel_threshold)
+
+async def _wait_for_condition(i: int, cmd: Command, cancel_event: threading.Event,
+                              baseline: Optional[np.ndarray]) -> WaitResult:
+    """
+    Polls cmd.region until the condition of a wait_until_stable / wait_until_changed /
+    wait_for_region_match command holds, the timeout expires or the batch is cancelled.
+    baseline is the region as it was before the previous command, used by wait_until_changed.
+    """
+    reference = None
+    if cmd.action == "wait_for_region_match":
+        if not cmd.reference_image_path:
+            raise _CommandError(f"Command {i} ('wait_for_region_match') missing 'reference_image_path' parameter.")
+        try:
+            reference = await run_in_capture_thread(_load_reference, cmd.reference_image_path, cmd.region)
+        except OSError as e:
+            raise _CommandError(f"Command {i} ('wait_for_region_match') cannot read reference image: {e}")
+
+    pixel_threshold = cmd.pixel_threshold or 0
+    tolerance = cmd.change_fraction or 0.0
+    started = time.monotonic()
+    deadline = started + (cmd.timeout or 0.0)
+    previous = baseline
+    stable_since = None
+    polls = 0
+    fraction = None
+    satisfied = False
+    while not cancel_event.is_set():
+        compare_to = reference if reference is not None else previous
+        current, fraction = await run_in_capture_thread(_poll_region, cmd.region, compare_to, pixel_threshold)
+        polls += 1
+        now = time.monotonic()
+        if cmd.action == "wait_for_region_match":
+            satisfied = fraction <= tolerance
+        elif cmd.action == "wait_until_changed":
+            if previous is None:
+                previous = current # 沒有基準畫面時以第一次擷取為基準
+            else:
+                satisfied = fraction > tolerance
+        else: # wait_until_stable
+            if stable_since is None or (fraction is not None and fraction > tolerance):
+                stable_since = now
+            satisfied = fraction is not None and now - stable_since >= (cmd.stable_time or 0.0)
+            previous = current
+        if satisfied or now >= deadline:
+            break
+        await _sleep_unless_cancelled(min(cmd.poll_interval or 0.0, deadline - now), cancel_event)
+
+    return WaitResult(
+        command_index=i,
+        action=cmd.action,
+        satisfied=satisfied,
+        waited_ms=round((time.monotonic() - started) * 1000, 3),
+        polls=polls,
+        change_fraction=fraction,
+    )
+
+async def control_input(commands: List[Command], profile: InputProfile = "default", ctx: Context = None) -> InputControlResult:
     """
     Executes a series of keyboard and mouse control commands.
+    Commands run on a dedicated input thread so the server stays responsive; 'wait' does not block.
+    Concurrent batches (including act_and_observe) run one after another, never interleaved.
+    Instead of fixed sleeps, wait_until_stable / wait_until_changed / wait_for_region_match poll a screen
+    region until a pixel-difference condition holds; each reports the time actually waited in wait_results.
+    wait_until_changed compares against the region as it was before the preceding command ran.
+    A running batch can be stopped with cancel_control_input (or by cancelling the request);
+    per-command timing is reported through MCP progress notifications and in command_timings_ms.
 
     Args:
         commands: A list of command objects to execute in sequence.
+        profile: Latency profile for the whole batch. "instant": no pause between calls, no mouse
+                 animation and no delay between typed characters. "default": 0.1 s pause and the
+                 commands' own durations. "human": 0.25 s pause, mouse movements of at least 0.4 s
+                 and slower typing.
 
     Returns:
-        An InputControlResult object indicating success or failure.
+        An InputControlResult object indicating success, failure or cancellation.
     """
-    for i, cmd in enumerate(commands):
-        try:
-            if cmd.comment:
-                print(f"Executing command {i} ({cmd.action}): {cmd.comment}")
-            else:
-                print(f"Executing command {i}: {cmd.action}")
-
-            if cmd.action == "click":
-                if cmd.x is not None and cmd.y is not None:
-                    pyautogui.click(x=cmd.x, y=cmd.y, clicks=cmd.clicks, button=cmd.button, duration=cmd.duration)
-                else:
-                    pyautogui.click(clicks=cmd.clicks, button=cmd.button, duration=cmd.duration) # 點擊目前位置
-            elif cmd.action == "double_click":
-                 if cmd.x is not None and cmd.y is not None:
-                    pyautogui.doubleClick(x=cmd.x, y=cmd.y, button=cmd.button, duration=cmd.duration)
-                 else:
-                    pyautogui.doubleClick(button=cmd.button, duration=cmd.duration)
-            elif cmd.action == "right_click":
-                if cmd.x is not None and cmd.y is not None:
-                    pyautogui.rightClick(x=cmd.x, y=cmd.y, duration=cmd.duration)
-                else:
-                    pyautogui.rightClick(duration=cmd.duration)
-            elif cmd.action == "middle_click":
-                if cmd.x is not None and cmd.y is not None:
-                    pyautogui.middleClick(x=cmd.x, y=cmd.y, duration=cmd.duration)
-                else:
-                    pyautogui.middleClick(duration=cmd.duration)
-            elif cmd.action == "type":
-                if cmd.text is not None:
-                    pyautogui.typewrite(cmd.text, interval=0.01) # interval 可調整打字速度
-                else:
-                    return InputControlResult(status="error", message=f"Command {i} ('type') missing 'text' parameter.", last_executed_command_index=i)
-            elif cmd.action == "press":
-                if cmd.keys is not None:
-                    if isinstance(cmd.keys, list):
-                        for key in cmd.keys: # pyautogui.press 不直接支援列表，需逐個按
-                            pyautogui.press(key)
+    loop = asyncio.get_running_loop()
+    latency_profile = _PROFILES[profile]
+    timings: list[float] = []
+    wait_results: list[WaitResult] = []
+    baselines: dict[int, np.ndarray] = {} # 指令索引 -> wait_until_changed 的基準畫面，在前一個指令執行前擷取
+    cancel_event = threading.Event()
+    _active_cancel_events.add(cancel_event)
+    try:
+        # 整個批次持有輸入鎖：同時執行的 control_input / act_and_observe 批次依序執行，不會交錯輸入
+        async with _batch_lock:
+            for i, cmd in enumerate(commands):
+                if cancel_event.is_set():
+                    return InputControlResult(status="cancelled", message=f"Cancelled before command {i}.", last_executed_command_index=i - 1 if i else None, command_timings_ms=timings, wait_results=wait_results)
+                started = time.perf_counter()
+                try:
+                    if cmd.comment:
+                        print(f"Executing command {i} ({cmd.action}): {cmd.comment}")
                     else:
-                        pyautogui.press(cmd.keys)
-                else:
-                    return InputControlResult(status="error", message=f"Command {i} ('press') missing 'keys' parameter.", last_executed_command_index=i)
-            elif cmd.action == "hotkey":
-                if cmd.keys is not None and isinstance(cmd.keys, list):
-                    pyautogui.hotkey(*cmd.keys) # hotkey 接受多個參數
-                elif cmd.keys is not None and isinstance(cmd.keys, str):
-                     pyautogui.hotkey(cmd.keys) # 也可接受單個字串代表的組合鍵，如 'ctrl+c'
-                else:
-                    return InputControlResult(status="error", message=f"Command {i} ('hotkey') missing 'keys' parameter or keys not a list/str.", last_executed_command_index=i)
-            elif cmd.action == "move_to":
-                if cmd.x is not None and cmd.y is not None:
-                    pyautogui.moveTo(cmd.x, cmd.y, duration=cmd.duration)
-                else:
-                    return InputControlResult(status="error", message=f"Command {i} ('move_to') missing 'x' or 'y' parameters.", last_executed_command_index=i)
-            elif cmd.action == "drag_to":
-                if cmd.x is not None and cmd.y is not None:
-                    pyautogui.dragTo(cmd.x, cmd.y, duration=cmd.duration, button=cmd.button)
-                else:
-                    return InputControlResult(status="error", message=f"Command {i} ('drag_to') missing 'x' or 'y' parameters.", last_executed_command_index=i)
-            elif cmd.action == "scroll":
-                if cmd.scroll_amount is not None:
-                    pyautogui.scroll(cmd.scroll_amount)
-                else:
-                    return InputControlResult(status="error", message=f"Command {i} ('scroll') missing 'scroll_amount' parameter.", last_executed_command_index=i)
-            elif cmd.action == "wait":
-                time.sleep(cmd.wait_time)
-            else:
-                return InputControlResult(status="error", message=f"Unknown action type '{cmd.action}' at command {i}.", last_executed_command_index=i)
+                        print(f"Executing command {i}: {cmd.action}")
+
+                    if i + 1 < len(commands) and commands[i + 1].action == "wait_until_changed":
+                        baselines[i + 1] = await run_in_capture_thread(_grab_watch_region, commands[i + 1].region)
+
+                    if cmd.action == "wait":
+                        await _sleep_unless_cancelled(cmd.wait_time, cancel_event)
+                    elif cmd.action in _CONDITION_WAITS:
+                        wait_result = await _wait_for_condition(i, cmd, cancel_event, baselines.pop(i, None))
+                        wait_results.append(wait_result)
+                        record(f"input.{cmd.action}", wait_result.waited_ms)
+                        if not wait_result.satisfied and not cancel_event.is_set():
+                            increment("input.wait_timeouts")
+                        if not wait_result.satisfied and not cancel_event.is_set() and cmd.fail_on_timeout:
+                            timings.append(wait_result.waited_ms)
+                            return InputControlResult(status="error", message=f"Command {i} ({cmd.action}) timed out after {cmd.timeout} s.", last_executed_command_index=i, command_timings_ms=timings, wait_results=wait_results)
+                    else:
+                        await loop.run_in_executor(_input_executor, _execute_command, i, cmd, cancel_event, latency_profile)
 
-        except pyautogui.FailSafeException:
-            return InputControlResult(status="error", message="FailSafeException: Mouse moved to a corner (likely top-left). Operation aborted.", last_executed_command_index=i)
-        except Exception as e:
-            return InputControlResult(status="error", message=f"Error executing command {i} ({cmd.action}): {str(e)}", last_executed_command_index=i)
-        
-    return InputControlResult(status="success", message="All commands executed successfully.")
+                except _CommandError as e:
+                    return InputControlResult(status="error", message=str(e), last_executed_command_index=i, command_timings_ms=timings, wait_results=wait_results)
+                except _FailSafeTriggered:
+                    return InputControlResult(status="error", message="FailSafeException: Mouse moved to a corner (likely top-left). Operation aborted.", last_executed_command_index=i, command_timings_ms=timings, wait_results=wait_results)
+                except asyncio.CancelledError:
+                    # 請求被取消：停止輸入執行緒上尚未完成的分段輸入
+                    cancel_event.set()
+                    raise
+                except Exception as e:
+                    return InputControlResult(status="error", message=f"Error executing command {i} ({cmd.action}): {str(e)}", last_executed_command_index=i, command_timings_ms=timings, wait_results=wait_results)
+
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                timings.append(round(elapsed_ms, 3))
+                if ctx is not None:
+                    await ctx.report_progress(i + 1, len(commands), message=f"Command {i} ({cmd.action}) took {elapsed_ms:.1f} ms")
+                if cancel_event.is_set():
+                    return InputControlResult(status="cancelled", message=f"Cancelled during command {i} ({cmd.action}).", last_executed_command_index=i, command_timings_ms=timings, wait_results=wait_results)
+    finally:
+        _active_cancel_events.discard(cancel_event)
+
+    return InputControlResult(status="success", message="All commands executed successfully.", completed_at=time.time(), command_timings_ms=timings, wait_results=wait_results)
+
+async def cancel_control_input() -> str:
+    """
+    Cancels every control_input batch that is currently running or waiting for another batch to finish.
+    The command in progress finishes (long 'type' text stops at the next chunk, 'wait' stops immediately)
+    and no further commands run.
+    """
+    count = len(_active_cancel_events)
+    for cancel_event in list(_active_cancel_events):
+        cancel_event.set()
+    return f"Cancellation requested for {count} running control_input batch(es)."
 
 # 範例 (供本地測試，不會被 MCP 直接呼叫):
 async def main_test():
@@ -124,6 +405,7 @@ async def main_test():
         Command(action="click", comment="Click there"),
         Command(action="type", text="Hello, PyAutoGUI!", comment="Type some text"),
         Command(action="press", keys="enter", comment="Press Enter"),
+        Command(action="paste_text", text="A longer paragraph inserted in one step.", comment="Paste text"),
         Command(action="wait", wait_time=2, comment="Wait for 2 seconds"),
         Command(action="move_to", x=500, y=500, duration=0.5),
         Command(action="drag_to", x=700, y=700, duration=1, button="left", comment="Drag something"),
@@ -135,7 +417,6 @@ async def main_test():
 
 if __name__ == "__main__":
     # 注意：直接執行此檔案會嘗試控制您的滑鼠和鍵盤！
-    # import asyncio
     # asyncio.run(main_test())
     print("This script defines the 'control_input' tool for an MCP server.")
     print("To test locally (BE CAREFUL), uncomment the asyncio.run(main_test()) lines.") 
\ No newline at end of file
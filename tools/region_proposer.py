@@ -0,0 +1,99 @@
+import asyncio
+import sys
+import time
+from typing import Optional
+
+import numpy as np
+from PIL import Image as PillowImage
+from pydantic import BaseModel
+
+from utils.bounds import SubAreaBounds
+from utils.path_utils import _normalize_path
+from utils.region_proposals import RegionKind, RegionProposal, bgra_to_gray, propose_regions
+from .subarea_tool import _get_in_memory_frame
+
+class RegionProposalResult(BaseModel):
+    width: int # 分析的畫面尺寸 (search_bounds 之前)
+    height: int
+    proposals: list[RegionProposal] # 依 score 由高到低排序，座標與 capture_screen 的影像相同
+    elapsed_ms: float
+    error: Optional[str] = None
+
+def _load_gray(source_frame, image_path: str) -> np.ndarray:
+    if source_frame is not None:
+        return bgra_to_gray(source_frame.as_array())
+    with PillowImage.open(_normalize_path(image_path)) as image:
+        return np.asarray(image.convert("L"))
+
+def _propose(source_frame, image_path: str, search_bounds: Optional[SubAreaBounds], **options) -> tuple[int, int, list[RegionProposal]]:
+    gray = _load_gray(source_frame, image_path)
+    height, width = gray.shape
+    x0 = y0 = 0
+    if search_bounds is not None:
+        x0, y0 = max(search_bounds.x, 0), max(search_bounds.y, 0)
+        gray = gray[y0:search_bounds.y + search_bounds.height, x0:search_bounds.x + search_bounds.width]
+    proposals = propose_regions(gray, **options) if gray.size else []
+    for proposal in proposals:
+        proposal.bounds.x += x0
+        proposal.bounds.y += y0
+    return width, height, proposals
+
+async def propose_subareas(
+    image_path: str = "",
+    use_buffered_frame: bool = False,
+    frame_timestamp: Optional[float] = None,
+    search_bounds: Optional[SubAreaBounds] = None,
+    kinds: Optional[list[RegionKind]] = None,
+    max_proposals: int = 40,
+    edge_threshold: int = 24,
+    min_gap: int = 16,
+    min_size: int = 12
+) -> RegionProposalResult:
+    """
+    Proposes sub-area bounds (buttons, text lines, panels, other elements) in a screenshot locally on the
+    CPU, without a model call, so get_subarea_description can be pointed at likely UI regions directly.
+    Runs in tens of milliseconds on a full-HD frame.
+
+    Args:
+        image_path: Path of a screenshot taken by capture_screen. Ignored when an in-memory frame is used.
+        use_buffered_frame: If True, analyse the capture daemon's frame (or the first one at or after
+                            frame_timestamp), otherwise the last frame taken by capture_screen; falls back to image_path.
+        frame_timestamp: See use_buffered_frame.
+        search_bounds: Only look inside this rectangle (image coordinates). Proposals are still returned
+                       in full-image coordinates.
+        kinds: Only return these kinds ("panel", "text", "button", "element"). Defaults to all.
+        max_proposals: Maximum number of proposals, best first.
+        edge_threshold: Minimum brightness difference (0-255) between neighbouring pixels to count as an edge.
+        min_gap: Minimum width in pixels of a whitespace band that separates two blocks.
+        min_size: Minimum width and height in pixels of a proposal.
+
+    Returns:
+        A RegionProposalResult whose proposals carry SubAreaBounds usable as bounds_list entries,
+        a kind, a 0-1 score and the edge density of the region.
+    """
+    started = time.perf_counter()
+    source_frame = _get_in_memory_frame(frame_timestamp) if use_buffered_frame else None
+    if source_frame is None and not image_path:
+        error_msg = "Error: No image_path given and no in-memory frame available."
+        print(error_msg, file=sys.stderr)
+        return RegionProposalResult(width=0, height=0, proposals=[], elapsed_ms=0.0, error=error_msg)
+
+    try:
+        # 邊緣偵測與分割都是 CPU 運算，在執行緒中進行，不阻塞 event loop
+        width, height, proposals = await asyncio.to_thread(
+            _propose, source_frame, image_path, search_bounds,
+            edge_threshold=edge_threshold, min_gap=min_gap, min_size=min_size,
+            max_proposals=max_proposals, kinds=kinds,
+        )
+    except FileNotFoundError:
+        error_msg = f"Error: Image not found at {_normalize_path(image_path)}"
+        print(error_msg, file=sys.stderr)
+        return RegionProposalResult(width=0, height=0, proposals=[], elapsed_ms=0.0, error=error_msg)
+    except Exception as e:
+        error_msg = f"Error proposing sub-areas: {str(e)}"
+        print(error_msg, file=sys.stderr)
+        return RegionProposalResult(width=0, height=0, proposals=[], elapsed_ms=0.0, error=error_msg)
+
+    elapsed_ms = round((time.perf_counter() - started) * 1000, 3)
+    print(f"Proposed {len(proposals)} sub-areas in {elapsed_ms:.1f} ms", file=sys.stderr) # stdout 是 MCP 的 stdio 通道
+    return RegionProposalResult(width=width, height=height, proposals=proposals, elapsed_ms=elapsed_ms)
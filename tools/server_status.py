@@ -0,0 +1,48 @@
+import os
+import sys
+from typing import Optional
+
+from pydantic import BaseModel
+
+from utils.perf_metrics import PerformanceSnapshot, metrics
+from utils.tool_registry import ToolModuleStatus, get_module_statuses, get_startup_ms
+
+class ServerStatus(BaseModel):
+    startup_ms: Optional[float] = None # 從載入工具到伺服器就緒的時間
+    modules: list[ToolModuleStatus]
+    unavailable_tools: list[str]
+    genai_key_configured: bool
+    loaded_heavy_modules: list[str] # 已被載入的延遲載入套件 (第一次使用後才會出現)
+
+# 這些套件只在第一次使用時才載入
+_HEAVY_MODULES = ("google.genai", "pyautogui", "mss")
+
+async def get_server_status() -> ServerStatus:
+    """
+    Reports the server's startup profile: how long each tool module took to import, which tools
+    are unavailable (and why), and which heavy dependencies have been loaded so far.
+    """
+    modules = get_module_statuses()
+    return ServerStatus(
+        startup_ms=get_startup_ms(),
+        modules=modules,
+        unavailable_tools=[name for status in modules if not status.available for name in status.tools],
+        genai_key_configured=bool(os.getenv("genaikey")),
+        loaded_heavy_modules=[name for name in _HEAVY_MODULES if name in sys.modules],
+    )
+
+async def get_performance_metrics(stage_prefix: Optional[str] = None, reset: bool = False) -> PerformanceSnapshot:
+    """
+    Returns latency histograms (with p50/p90/p99 over the most recent samples) and counters for every
+    measured stage since the server started or the last reset: whole tool calls ("tool.*"), screen grab,
+    encode, diff and disk writes ("capture.*"), cropping and crop saving ("subarea.*"), image preprocessing,
+    model latency, cache hits and retries ("genai.*") and pyautogui execution per action ("input.*").
+
+    Args:
+        stage_prefix: Only return stages and counters whose name starts with this prefix (e.g. "genai.").
+        reset: Clear all histograms and counters after taking the snapshot.
+    """
+    snapshot = metrics.snapshot(stage_prefix)
+    if reset:
+        metrics.reset()
+    return snapshot
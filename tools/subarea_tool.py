@@ -1,45 +1,103 @@
 from PIL import Image as PillowImage
-from pydantic import BaseModel
-import os
 import asyncio
+import sys
 from pathlib import Path
 import uuid # For unique IDs in filenames
+from typing import Literal, Optional
+from mcp.server.fastmcp import Context
 # import urllib.parse # For URL decoding path components - Moved to path_utils
 # import platform # To check OS - Moved to path_utils
 # import re # Import re for regex matching - Moved to path_utils
 from utils.path_utils import _normalize_path
+from utils.frame_ring_buffer import get_buffered_frame
+from utils.screen_grabber import Frame
+from utils.bounds import SubAreaBounds
+from utils.tmp_retention import enforce_retention
+from utils.perf_metrics import span
+from utils.result_progress import ResultProgress
 
 # 從 google_genai 工具導入必要的函數
-from .google_genai import generate_text_from_google
+from .google_genai import describe_images, generate_batched_text_from_google
+from .capture_screen import get_last_frame
 
-class SubAreaBounds(BaseModel):
-    x: int
-    y: int
-    width: int
-    height: int
+def _get_in_memory_frame(frame_timestamp: Optional[float]):
+    """Prefers the capture daemon's frame, then the last frame kept in memory by capture_screen."""
+    # 裁剪在執行緒中進行，期間 slot 可能被覆寫，因此取私有副本
+    frame = get_buffered_frame(frame_timestamp, copy=True)
+    if frame is None:
+        last_frame = get_last_frame()
+        if last_frame is not None and (frame_timestamp is None or last_frame.timestamp >= frame_timestamp):
+            frame = last_frame
+    return frame
 
 async def get_subarea_description(
     image_path: str, 
     bounds_list: list[SubAreaBounds], 
     prompt: str,
-    current_working_dir: str
+    current_working_dir: str,
+    use_buffered_frame: bool = False,
+    frame_timestamp: Optional[float] = None,
+    mode: Literal["per_image", "multi_image", "contact_sheet"] = "per_image",
+    save_crops: bool = True,
+    model: Optional[str] = None,
+    stream: bool = False,
+    ctx: Context = None
 ) -> dict[str, str]:
     """
-    Crops multiple sub-areas from an image, saves them to uniquely named files (containing bounds info)
-    in a temporary directory, and then calls the genai function to get descriptions for all sub-areas.
+    Crops multiple sub-areas from an image and calls the genai function to get descriptions for all sub-areas.
+    The crops are handed to the model client in memory; when save_crops is True they are also written to
+    uniquely named files (containing bounds info) in a temporary directory, off the event loop and in
+    parallel with the model calls.
+    Each sub-area's description is sent as an MCP progress notification as soon as it is ready (per batch
+    in the batched modes), so the caller can act on the first relevant region while the rest are in flight.
 
     Args:
         image_path: Path to the original image file.
         bounds_list: A list of SubAreaBounds objects, each defining a sub-area to crop.
         prompt: The common prompt to use for generating descriptions for all sub-areas.
         current_working_dir: The current working directory, used to create a 'tmp/subareas' folder.
+        use_buffered_frame: If True, crop from a frame kept in memory instead of opening image_path: the capture
+                            daemon's most recent frame (or the first one at or after frame_timestamp), otherwise
+                            the last frame taken by capture_screen (including diff_mode captures).
+                            Falls back to image_path when no such frame is available.
+        frame_timestamp: See use_buffered_frame.
+        mode: "per_image" (default) sends one model request per sub-area. "multi_image" sends all crops in
+              one request and "contact_sheet" tiles them into one labelled image; both ask for a structured
+              JSON answer that is split back per crop, and are chunked to fit the model's request limits.
+        save_crops: Whether to write the crops to tmp/subareas. The directory is pruned to the
+                    MCP_TMP_MAX_BYTES / MCP_TMP_MAX_AGE_SECONDS quotas after each call.
+        model: Model for this call, optionally prefixed with its backend ("openai:gpt-4o", "gemini:...").
+               Defaults to the GENAI_BACKEND backend's default model.
+        stream: In "per_image" mode, use the model's streaming API and send the text received so far as
+                log notifications.
 
     Returns:
-        A dictionary where keys are the file paths of the saved sub-area images 
-        and values are their corresponding descriptions from the GenAI model or an error message.
+        A dictionary where keys are the file paths of the sub-area images (the files exist only if
+        save_crops is True) and values are their corresponding descriptions from the GenAI model or an error message.
+    """
+    # 直接使用記憶體中的畫面，只轉換被裁剪的像素
+    source_frame = _get_in_memory_frame(frame_timestamp) if use_buffered_frame else None
+    return await describe_frame_subareas(source_frame, image_path, bounds_list, prompt, current_working_dir,
+                                         mode=mode, save_crops=save_crops, model=model, stream=stream, ctx=ctx)
+
+async def describe_frame_subareas(
+    source_frame: Optional[Frame],
+    image_path: str,
+    bounds_list: list[SubAreaBounds],
+    prompt: str,
+    current_working_dir: str,
+    mode: Literal["per_image", "multi_image", "contact_sheet"] = "per_image",
+    save_crops: bool = True,
+    model: Optional[str] = None,
+    stream: bool = False,
+    ctx: Context = None
+) -> dict[str, str]:
+    """
+    get_subarea_description for callers that hold the frame to crop (e.g. the one capture_screen just
+    took): crops source_frame, or image_path when it is None, instead of looking a frame up again.
     """
     results = {}
-    sub_image_paths_for_genai = []
+    crops_for_genai = {}
     
     # 標準化 current_working_dir 和 image_path
     normalized_cwd = _normalize_path(current_working_dir)
@@ -47,7 +105,8 @@ async def get_subarea_description(
 
     subareas_tmp_dir = normalized_cwd / "tmp" / "subareas"
     try:
-        subareas_tmp_dir.mkdir(parents=True, exist_ok=True)
+        if save_crops:
+            subareas_tmp_dir.mkdir(parents=True, exist_ok=True)
     except Exception as e:
         error_msg = f"Error creating subarea directory {subareas_tmp_dir}: {str(e)}"
         print(error_msg)
@@ -57,7 +116,7 @@ async def get_subarea_description(
         return results
 
     try:
-        original_image = PillowImage.open(normalized_original_image_path)
+        original_image = None if source_frame is not None else PillowImage.open(normalized_original_image_path)
     except FileNotFoundError:
         error_msg = f"Error: Original image not found at {normalized_original_image_path}"
         print(error_msg)
@@ -73,31 +132,35 @@ async def get_subarea_description(
             results[key] = error_msg
         return results
 
-    for bounds_item in bounds_list:
-        unique_id = uuid.uuid4().hex[:6]
-        # 檔名中包含原始邊界值，saved_image_path 本身是標準化路徑
-        filename = f"subarea_x{bounds_item.x}_y{bounds_item.y}_w{bounds_item.width}_h{bounds_item.height}_{unique_id}.png"
-        saved_image_path = subareas_tmp_dir / filename # This is already a Path object
-        
-        try:
-            crop_box = (bounds_item.x, bounds_item.y, bounds_item.x + bounds_item.width, bounds_item.y + bounds_item.height)
-            cropped_image = original_image.crop(crop_box)
-            cropped_image.save(saved_image_path) # Path object can be passed to save
-            sub_image_paths_for_genai.append(str(saved_image_path)) # Pass string representation
-            results[str(saved_image_path)] = "Pending GenAI description..."
+    # 裁剪 (含原圖解碼) 在執行緒中進行，不阻塞 event loop
+    with span("subarea.crop"):
+        crops_for_genai, crop_errors = await asyncio.to_thread(
+            _crop_all, source_frame, original_image, bounds_list, subareas_tmp_dir
+        )
+    results.update((path, "Pending GenAI description...") for path in crops_for_genai)
+    results.update(crop_errors)
 
-        except Exception as e:
-            error_msg = f"Error processing/saving sub-area for bounds {bounds_item}: {str(e)}"
-            print(error_msg)
-            results[str(saved_image_path)] = error_msg
-    
-    if not sub_image_paths_for_genai:
+    if not crops_for_genai:
         if not results:
              print("No sub-images were successfully processed to send to GenAI.")
         return results
 
+    # 存檔為選擇性步驟，與模型呼叫同時在背景執行緒進行，模型端不會再從磁碟讀回
+    save_task = asyncio.create_task(asyncio.to_thread(_save_crops, crops_for_genai, subareas_tmp_dir)) if save_crops else None
+
+    progress = ResultProgress(ctx, total=len(crops_for_genai))
     try:
-        genai_results = await generate_text_from_google(prompt=prompt, image_paths=sub_image_paths_for_genai)
+        with span(f"subarea.describe.{mode}"):
+            if mode == "per_image":
+                genai_results = await describe_images(
+                    prompt=prompt, images=crops_for_genai, model=model, stream=stream, progress=progress,
+                    current_working_dir=current_working_dir
+                )
+            else:
+                genai_results = await generate_batched_text_from_google(
+                    prompt=prompt, images=crops_for_genai, mode=mode, model=model, progress=progress,
+                    current_working_dir=current_working_dir
+                )
         for path, description in genai_results.items():
             # genai_results 鍵是原始傳入的路徑 (已經是標準化的 str(saved_image_path))
             # 所以可以直接用來更新 results 字典
@@ -106,8 +169,44 @@ async def get_subarea_description(
     except Exception as e:
         error_msg = f"Critical error calling batch generate_text_from_google: {str(e)}"
         print(error_msg)
-        for path in sub_image_paths_for_genai:
+        for path in crops_for_genai:
             if results.get(path) == "Pending GenAI description...":
                 results[path] = error_msg
+
+    if save_task is not None:
+        try:
+            await save_task
+        except Exception as e:
+            print(f"Error saving sub-area crops to {subareas_tmp_dir}: {str(e)}", file=sys.stderr) # stdout 是 MCP 的 stdio 通道
                 
-    return results 
\ No newline at end of file
+    return results 
+
+def _crop_all(source_frame, original_image, bounds_list: list[SubAreaBounds],
+              subareas_tmp_dir: Path) -> tuple[dict[str, PillowImage.Image], dict[str, str]]:
+    crops = {}
+    errors = {}
+    for bounds_item in bounds_list:
+        unique_id = uuid.uuid4().hex[:6]
+        # 檔名中包含原始邊界值，saved_image_path 本身是標準化路徑
+        filename = f"subarea_x{bounds_item.x}_y{bounds_item.y}_w{bounds_item.width}_h{bounds_item.height}_{unique_id}.png"
+        saved_image_path = subareas_tmp_dir / filename # This is already a Path object
+
+        try:
+            crop_box = (bounds_item.x, bounds_item.y, bounds_item.x + bounds_item.width, bounds_item.y + bounds_item.height)
+            if source_frame is not None:
+                cropped_image = source_frame.crop_to_pil(bounds_item.x, bounds_item.y, bounds_item.width, bounds_item.height)
+            else:
+                cropped_image = original_image.crop(crop_box)
+                cropped_image.load()
+            crops[str(saved_image_path)] = cropped_image # Pass string representation
+        except Exception as e:
+            error_msg = f"Error processing sub-area for bounds {bounds_item}: {str(e)}"
+            print(error_msg)
+            errors[str(saved_image_path)] = error_msg
+    return crops, errors
+
+def _save_crops(crops: dict[str, PillowImage.Image], subareas_tmp_dir: Path) -> None:
+    with span("subarea.save"):
+        for path, cropped_image in crops.items():
+            cropped_image.save(path, compress_level=1)
+        enforce_retention(subareas_tmp_dir)
@@ -0,0 +1,244 @@
+"""
+Offline benchmark of the capture -> propose -> describe pipeline.
+
+    python -m utils.benchmark --iterations 20 --json tmp/bench.json
+    python -m utils.benchmark --baseline tmp/bench.json        # exit code 1 on a regression
+    xvfb-run -s "-screen 0 1920x1080x24" python -m utils.benchmark --source screen --include-input
+
+By default frames come from a synthetic UI-like screen (no display needed) and the model is the
+local stub (utils.stub_vision_server), so runs are repeatable on one machine and configurations
+(image formats, GENAI_* / MCP_* settings, stub latency) can be compared against a saved baseline.
+Per-stage timings are taken from utils.perf_metrics, the same spans get_performance_metrics reports.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from typing import Optional
+
+import numpy as np
+from PIL import Image as PillowImage
+from PIL import ImageDraw
+
+
+class _SyntheticShot:
+    __slots__ = ("bgra", "width", "height")
+
+    def __init__(self, bgra: bytes, width: int, height: int):
+        self.bgra = bgra
+        self.width = width
+        self.height = height
+
+
+class SyntheticScreen:
+    """
+    Stands in for an mss instance: a virtual screen with a UI-like layout (title bar, sidebar, text,
+    buttons) on each monitor. A small "clock" area changes on every grab so diff_mode has work to do.
+    """
+
+    def __init__(self, sizes: list[tuple[int, int]]):
+        self.monitors = [{}]
+        left = 0
+        for width, height in sizes:
+            self.monitors.append({"left": left, "top": 0, "width": width, "height": height})
+            left += width
+        total_width, total_height = left, max(height for _, height in sizes)
+        self.monitors[0] = {"left": 0, "top": 0, "width": total_width, "height": total_height}
+        self._screen = np.zeros((total_height, total_width, 4), dtype=np.uint8)
+        for monitor in self.monitors[1:]:
+            ui = np.asarray(_draw_ui(monitor["width"], monitor["height"]))
+            self._screen[:monitor["height"], monitor["left"]:monitor["left"] + monitor["width"], :3] = ui[..., ::-1]
+        self._grabs = 0
+
+    def grab(self, area: dict) -> _SyntheticShot:
+        self._grabs += 1
+        self._screen[8:32, 8:72, :3] = (self._grabs * 37) % 256 # 每次擷取都會變化的小區域
+        left, top = area["left"], area["top"]
+        pixels = self._screen[top:top + area["height"], left:left + area["width"]]
+        return _SyntheticShot(np.ascontiguousarray(pixels).tobytes(), pixels.shape[1], pixels.shape[0])
+
+
+def _draw_ui(width: int, height: int) -> PillowImage.Image:
+    image = PillowImage.new("RGB", (width, height), (240, 240, 240))
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((0, 0, width, 40), fill=(45, 45, 55))
+    draw.text((96, 12), "File   Edit   View   Window   Help", fill=(255, 255, 255))
+    sidebar = width // 6
+    draw.rectangle((0, 41, sidebar, height), fill=(225, 225, 232))
+    for i in range((height - 80) // 40):
+        draw.text((16, 64 + 40 * i), f"Navigation item {i}", fill=(20, 20, 20))
+    for i in range((height - 200) // 18):
+        draw.text((sidebar + 40, 80 + 18 * i), "The quick brown fox jumps over the lazy dog. " * 3, fill=(30, 30, 30))
+    for i, label in enumerate(("OK", "Cancel", "Apply")):
+        x = width - 380 + 120 * i
+        draw.rectangle((x, height - 70, x + 100, height - 35), fill=(0, 120, 215), outline=(0, 0, 0))
+        draw.text((x + 30, height - 60), label, fill=(255, 255, 255))
+    return image
+
+
+def _summary(samples: list[float]) -> dict:
+    ordered = sorted(samples)
+    return {
+        "iterations": len(samples),
+        "min_ms": round(ordered[0], 3),
+        "median_ms": round(statistics.median(ordered), 3),
+        "p90_ms": round(ordered[min(len(ordered) - 1, int(0.9 * len(ordered)))], 3),
+    }
+
+
+async def _measure(name: str, fn, iterations: int, results: dict) -> None:
+    await fn() # 第一次呼叫包含延遲載入與連線建立，不計入
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        await fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    results[name] = _summary(samples)
+    print(f"{name:<48} median {results[name]['median_ms']:>9.2f} ms   p90 {results[name]['p90_ms']:>9.2f} ms", flush=True)
+
+
+async def run_benchmarks(args) -> dict:
+    # 工具模組在設定好環境變數 (與合成螢幕) 之後才匯入
+    from tools.capture_screen import CaptureTarget, capture_screen, capture_screens
+    from tools.region_proposer import propose_subareas
+    from tools.subarea_tool import get_subarea_description
+    from utils.bounds import SubAreaBounds
+    from utils.perf_metrics import metrics
+    from utils.vision_backends import close_backends
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="mcp-bench-")
+    results: dict = {}
+    metrics.reset()
+
+    for image_format in args.formats:
+        await _measure(f"capture_screen[{image_format}]",
+                       lambda: capture_screen(workdir, image_format=image_format, png_compress_level=args.png_level),
+                       args.iterations, results)
+    region = SubAreaBounds(x=200, y=100, width=400, height=300)
+    await _measure("capture_screen[png, 400x300 region]", lambda: capture_screen(workdir, region=region),
+                   args.iterations, results)
+    await _measure("capture_screen[diff_mode]", lambda: capture_screen(workdir, diff_mode=True, inline=True),
+                   args.iterations, results)
+    await _measure("capture_screens[4 regions]",
+                   lambda: capture_screens(workdir, targets=[
+                       CaptureTarget(region=SubAreaBounds(x=200 * i, y=100, width=400, height=300)) for i in range(4)
+                   ]),
+                   args.iterations, results)
+
+    await capture_screen(workdir) # 之後的步驟使用這張畫面
+    proposals = (await propose_subareas(use_buffered_frame=True, max_proposals=args.crops)).proposals
+    await _measure("propose_subareas", lambda: propose_subareas(use_buffered_frame=True), args.iterations, results)
+
+    bounds = [proposal.bounds for proposal in proposals] or [region]
+    for mode in args.modes:
+        await _measure(f"get_subarea_description[{mode}, {len(bounds)} crops]",
+                       lambda: get_subarea_description("", bounds, "Describe this UI element.", workdir,
+                                                       use_buffered_frame=True, mode=mode, save_crops=False),
+                       max(1, args.iterations // 4), results)
+
+    if args.include_input:
+        from tools.input_controller import Command, control_input
+        commands = [Command(action="move_to", x=100 + 10 * i, y=100) for i in range(20)]
+        await _measure("control_input[20 x move_to, instant]", lambda: control_input(commands, profile="instant"),
+                       args.iterations, results)
+
+    await close_backends()
+    return {
+        "config": {
+            "source": args.source,
+            "screens": args.screens,
+            "model_latency_ms": args.model_latency_ms,
+            "png_level": args.png_level,
+            "python": sys.version.split()[0],
+            "env": {key: value for key, value in os.environ.items() if key.startswith(("GENAI_", "MCP_"))},
+        },
+        "scenarios": results,
+        "stages": metrics.snapshot().model_dump(),
+    }
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Returns the scenarios whose median got slower than the baseline's by more than tolerance."""
+    regressions = []
+    print(f"\n{'scenario':<48} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, current in report["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if previous is None:
+            continue
+        change = current["median_ms"] / previous["median_ms"] - 1 if previous["median_ms"] else 0.0
+        flag = "  REGRESSION" if change > tolerance else ""
+        print(f"{name:<48} {previous['median_ms']:>10.2f} {current['median_ms']:>10.2f} {change:>+7.0%}{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def _print_stages(report: dict) -> None:
+    print(f"\n{'stage':<48} {'count':>6} {'p50 ms':>9} {'p90 ms':>9} {'max ms':>9}")
+    for stage in report["stages"]["stages"]:
+        print(f"{stage['stage']:<48} {stage['count']:>6} {stage['p50_ms']:>9.2f} {stage['p90_ms']:>9.2f} {stage['max_ms']:>9.2f}")
+    for name, value in report["stages"]["counters"].items():
+        print(f"{name:<48} {value:>14,.0f}")
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--source", choices=("synthetic", "screen"), default="synthetic",
+                        help="synthetic frames (default) or the real/virtual display through mss")
+    parser.add_argument("--screens", default="1920x1080", help="synthetic monitor sizes, e.g. 3840x2160,1920x1080")
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--formats", nargs="+", default=["png", "jpeg", "raw"])
+    parser.add_argument("--png-level", type=int, default=1)
+    parser.add_argument("--modes", nargs="+", default=["per_image", "multi_image", "contact_sheet"])
+    parser.add_argument("--crops", type=int, default=8, help="number of proposed regions sent to the model")
+    parser.add_argument("--model-latency-ms", type=float, default=200.0, help="stub model latency")
+    parser.add_argument("--model-jitter-ms", type=float, default=0.0)
+    parser.add_argument("--real-model", action="store_true", help="use the configured GENAI_BACKEND instead of the stub")
+    parser.add_argument("--include-input", action="store_true",
+                        help="also run control_input (moves the real pointer; use a virtual display)")
+    parser.add_argument("--workdir", default=None, help="directory for screenshots (default: a new temp dir)")
+    parser.add_argument("--json", default=None, help="write the report to this file")
+    parser.add_argument("--baseline", default=None, help="compare against a report written with --json")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed median slowdown vs the baseline")
+    args = parser.parse_args(argv)
+
+    if args.source == "synthetic":
+        from utils import screen_grabber
+        sizes = [tuple(int(v) for v in size.split("x")) for size in args.screens.split(",")]
+        synthetic = SyntheticScreen(sizes)
+        screen_grabber._get_sct = lambda: synthetic # 所有擷取執行緒共用合成螢幕 (唯讀，除了變化區域)
+
+    stub = None
+    if not args.real_model:
+        from utils.stub_vision_server import StubOptions, start_stub_server
+        stub = start_stub_server(options=StubOptions(latency_ms=args.model_latency_ms, jitter_ms=args.model_jitter_ms, seed=0))
+        host, port = stub.server_address[:2]
+        os.environ.update({"GENAI_BACKEND": "openai", "OPENAI_BASE_URL": f"http://{host}:{port}/v1", "OPENAI_API_KEY": ""})
+    os.environ.setdefault("GENAI_CACHE", "0") # 量測模型往返，而不是快取
+
+    report = asyncio.run(run_benchmarks(args))
+    if stub is not None:
+        report["config"]["stub_stats"] = stub.stub_state.as_dict()
+        stub.shutdown()
+    _print_stages(report)
+
+    if args.json:
+        os.makedirs(os.path.dirname(os.path.abspath(args.json)), exist_ok=True)
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {args.json}")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} scenario(s) slower than the baseline by more than {args.tolerance:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,7 @@
+from pydantic import BaseModel
+
+class SubAreaBounds(BaseModel):
+    x: int
+    y: int
+    width: int
+    height: int
@@ -0,0 +1,106 @@
+from collections import deque
+
+import numpy as np
+
+from utils.bounds import SubAreaBounds
+from utils.screen_grabber import Frame
+
+
+def changed_tile_mask(previous: Frame, current: Frame, tile_size: int = 32, pixel_threshold: int = 0) -> np.ndarray:
+    """
+    Compares two equally sized frames tile by tile and returns a boolean (rows, cols) grid of changed tiles.
+
+    Pixels are first compared exactly as packed 32-bit BGRA words, which is the cheapest test.
+    A positive pixel_threshold then ignores per-channel differences up to that value (useful
+    for video or anti-aliasing noise); it is only evaluated on tile rows that changed at all.
+    """
+    height, width = current.height, current.width
+    prev_words = np.frombuffer(previous.bgra, dtype=np.uint32).reshape(height, width)
+    curr_words = np.frombuffer(current.bgra, dtype=np.uint32).reshape(height, width)
+    changed = prev_words != curr_words
+    if pixel_threshold > 0:
+        # 只在有像素變動的 tile 列上計算逐通道差值，未變動的區域不必付出這個成本
+        prev_pixels, curr_pixels = previous.as_array(), current.as_array()
+        for band_top in range(0, height, tile_size):
+            band = slice(band_top, band_top + tile_size)
+            if not changed[band].any():
+                continue
+            diff = np.maximum(prev_pixels[band], curr_pixels[band])
+            diff -= np.minimum(prev_pixels[band], curr_pixels[band])
+            diff[..., 3] = 0  # 忽略 alpha 通道
+            # 將每個像素的 4 個布林值視為一個 32-bit 整數，任一通道超過門檻即非零
+            changed[band] = (diff > pixel_threshold).view(np.uint32)[..., 0] != 0
+
+    rows = -(-height // tile_size)
+    cols = -(-width // tile_size)
+    padded = np.zeros((rows * tile_size, cols * tile_size), dtype=bool)
+    padded[:height, :width] = changed
+    return padded.reshape(rows, tile_size, cols, tile_size).any(axis=(1, 3))
+
+
+def tile_mask_to_bounds(mask: np.ndarray, tile_size: int, frame_width: int, frame_height: int,
+                        padding: int = 0, max_regions: int = 16) -> list[SubAreaBounds]:
+    """
+    Groups 8-connected changed tiles into bounding boxes in frame pixel coordinates.
+    If there are more than max_regions groups, a single box covering all changes is returned.
+    """
+    rows, cols = mask.shape
+    visited = np.zeros_like(mask)
+    boxes = []
+    # tile 格線很小 (4K 螢幕以 32px 切分約 120x68)，逐格 flood fill 即可
+    for start_row, start_col in np.argwhere(mask):
+        if visited[start_row, start_col]:
+            continue
+        min_r = max_r = start_row
+        min_c = max_c = start_col
+        queue = deque([(start_row, start_col)])
+        visited[start_row, start_col] = True
+        while queue:
+            r, c = queue.popleft()
+            min_r, max_r = min(min_r, r), max(max_r, r)
+            min_c, max_c = min(min_c, c), max(max_c, c)
+            for nr in range(max(r - 1, 0), min(r + 2, rows)):
+                for nc in range(max(c - 1, 0), min(c + 2, cols)):
+                    if mask[nr, nc] and not visited[nr, nc]:
+                        visited[nr, nc] = True
+                        queue.append((nr, nc))
+        boxes.append((min_r, max_r, min_c, max_c))
+
+    if len(boxes) > max_regions:
+        boxes = [(min(b[0] for b in boxes), max(b[1] for b in boxes), min(b[2] for b in boxes), max(b[3] for b in boxes))]
+
+    result = []
+    for min_r, max_r, min_c, max_c in boxes:
+        x0 = max(int(min_c) * tile_size - padding, 0)
+        y0 = max(int(min_r) * tile_size - padding, 0)
+        x1 = min((int(max_c) + 1) * tile_size + padding, frame_width)
+        y1 = min((int(max_r) + 1) * tile_size + padding, frame_height)
+        result.append(SubAreaBounds(x=x0, y=y0, width=x1 - x0, height=y1 - y0))
+    return result
+
+
+def changed_regions(previous: Frame | None, current: Frame, tile_size: int = 32, pixel_threshold: int = 0,
+                    padding: int = 0, max_regions: int = 16) -> list[SubAreaBounds]:
+    """
+    Returns the regions of current that differ from previous. Without a comparable previous
+    frame (first capture or resolution change) the whole frame is reported as changed.
+    """
+    if previous is None or previous.size != current.size:
+        return [SubAreaBounds(x=0, y=0, width=current.width, height=current.height)]
+    mask = changed_tile_mask(previous, current, tile_size=tile_size, pixel_threshold=pixel_threshold)
+    return tile_mask_to_bounds(mask, tile_size, current.width, current.height, padding=padding, max_regions=max_regions)
+
+
+def changed_pixel_fraction(reference: np.ndarray, current: np.ndarray, pixel_threshold: int = 0) -> float:
+    """
+    Returns the fraction of pixels whose B, G or R value differs by more than pixel_threshold.
+    Both arrays are (height, width, channels) in the same channel order; only the first three
+    channels are compared. Arrays of different sizes count as completely changed.
+    """
+    if reference.shape[:2] != current.shape[:2]:
+        return 1.0
+    ref, cur = reference[..., :3], current[..., :3]
+    diff = np.maximum(ref, cur)
+    diff -= np.minimum(ref, cur)
+    changed = (diff > pixel_threshold).any(axis=-1)
+    return float(np.count_nonzero(changed)) / changed.size if changed.size else 0.0
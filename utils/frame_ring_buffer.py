@@ -0,0 +1,265 @@
+import atexit
+import os
+import sys
+import threading
+import time
+from multiprocessing import shared_memory
+from typing import Optional
+
+import numpy as np
+
+from utils.screen_grabber import Frame, get_monitors, grab_monitor
+
+# 連續擷取失敗時，只記錄第一次與之後每這麼多次 (失敗次數已計入 dropped_frames)
+_GRAB_FAILURE_LOG_INTERVAL = 100
+
+# 每個 slot 的標頭。seq 採用 seqlock 語意：寫入中為奇數，寫入完成為偶數。
+_SLOT_HEADER_DTYPE = np.dtype([
+    ("seq", "<u8"),
+    ("timestamp", "<f8"),
+    ("width", "<i4"),
+    ("height", "<i4"),
+    ("left", "<i4"),
+    ("top", "<i4"),
+    ("scale", "<f4"),
+])
+# 整個 buffer 的標頭：最新寫入的 slot 與累計寫入的畫面數
+_RING_HEADER_DTYPE = np.dtype([("latest_slot", "<i8"), ("frames_written", "<u8")])
+
+
+class FrameRingBuffer:
+    """
+    A fixed-size ring of BGRA frames stored in multiprocessing shared memory.
+
+    There is a single writer (the capture daemon). Readers get Frame objects whose
+    bgra is a memoryview into the shared block, so reading never copies pixels. A view
+    stays valid until the writer wraps around to the same slot (slots / fps seconds);
+    pass copy=True to get a private, seqlock-checked copy instead.
+    """
+
+    def __init__(self, slot_count: int, slot_bytes: int, name: Optional[str] = None, create: bool = True):
+        self.slot_count = slot_count
+        self.slot_bytes = slot_bytes
+        headers_size = _RING_HEADER_DTYPE.itemsize + _SLOT_HEADER_DTYPE.itemsize * slot_count
+        # 讓畫面資料 64-byte 對齊
+        self._data_offset = (headers_size + 63) // 64 * 64
+        total_size = self._data_offset + slot_bytes * slot_count
+        self._shm = shared_memory.SharedMemory(name=name, create=create, size=total_size if create else 0)
+        self._owner = create
+
+        buf = self._shm.buf
+        self._ring_header = np.ndarray((1,), dtype=_RING_HEADER_DTYPE, buffer=buf, offset=0)
+        self._slot_headers = np.ndarray((slot_count,), dtype=_SLOT_HEADER_DTYPE, buffer=buf, offset=_RING_HEADER_DTYPE.itemsize)
+        if create:
+            self._ring_header[0] = (-1, 0)
+            self._slot_headers[:] = 0
+
+    @property
+    def name(self) -> str:
+        """Shared memory block name; another process can attach with FrameRingBuffer(..., name=name, create=False)."""
+        return self._shm.name
+
+    @property
+    def nbytes(self) -> int:
+        return self._shm.size
+
+    @property
+    def frames_written(self) -> int:
+        return int(self._ring_header[0]["frames_written"])
+
+    def _slot_view(self, slot: int, length: int) -> memoryview:
+        start = self._data_offset + slot * self.slot_bytes
+        return self._shm.buf[start:start + length]
+
+    def write(self, frame: Frame) -> bool:
+        """Copies a frame into the next slot. Returns False if the frame does not fit in a slot."""
+        length = frame.width * frame.height * 4
+        if length > self.slot_bytes:
+            return False
+        slot = (int(self._ring_header[0]["latest_slot"]) + 1) % self.slot_count
+        seq = int(self._slot_headers["seq"][slot])
+        self._slot_headers["seq"][slot] = seq + 1  # 標記寫入中
+        self._slot_view(slot, length)[:] = frame.bgra
+        self._slot_headers[slot] = (seq + 2, frame.timestamp, frame.width, frame.height, frame.left, frame.top, frame.scale)
+        self._ring_header[0] = (slot, self.frames_written + 1)
+        return True
+
+    def _read_slot(self, slot: int, copy: bool) -> Optional[Frame]:
+        for _ in range(3):
+            header = self._slot_headers[slot].copy()
+            seq = int(header["seq"])
+            if seq == 0:
+                return None
+            if seq % 2 == 1:
+                continue  # 寫入中，重試
+            width, height = int(header["width"]), int(header["height"])
+            bgra = self._slot_view(slot, width * height * 4)
+            if copy:
+                bgra = bytes(bgra)
+                if int(self._slot_headers["seq"][slot]) != seq:
+                    continue  # 複製期間被覆寫，重試
+            return Frame(bgra, width, height, int(header["left"]), int(header["top"]), float(header["timestamp"]),
+                         float(header["scale"]))
+        return None
+
+    def latest(self, copy: bool = False) -> Optional[Frame]:
+        """Returns the most recently written frame, or None if nothing was captured yet."""
+        slot = int(self._ring_header[0]["latest_slot"])
+        if slot < 0:
+            return None
+        return self._read_slot(slot, copy)
+
+    def at_or_after(self, timestamp: float, copy: bool = False) -> Optional[Frame]:
+        """Returns the oldest buffered frame captured at or after timestamp, or None if there is none yet."""
+        seqs = self._slot_headers["seq"]
+        timestamps = self._slot_headers["timestamp"]
+        valid = (seqs > 0) & (seqs % 2 == 0) & (timestamps >= timestamp)
+        if not valid.any():
+            return None
+        candidates = np.flatnonzero(valid)
+        return self._read_slot(int(candidates[np.argmin(timestamps[candidates])]), copy)
+
+    def close(self) -> None:
+        # numpy 視圖必須先釋放，否則 SharedMemory.close() 會因仍有 export 而失敗
+        self._ring_header = None
+        self._slot_headers = None
+        try:
+            self._shm.close()
+        except BufferError:
+            # 仍有讀取端持有零拷貝的 Frame；交由行程結束時釋放
+            pass
+        if self._owner:
+            self._shm.unlink()
+
+
+class CaptureDaemon(threading.Thread):
+    """
+    Background thread that grabs a monitor at a fixed rate into a FrameRingBuffer.
+
+    The CPU cap limits the share of wall time spent grabbing: if a grab takes 20 ms and
+    max_cpu_percent is 25, frames are spaced at least 80 ms apart even if fps asks for more.
+    The memory cap limits the number of slots the ring may hold.
+    """
+
+    def __init__(self, fps: float = 10.0, slot_count: int = 8, max_memory_mb: float = 256.0,
+                 max_cpu_percent: float = 50.0, monitor_index: int = 1):
+        super().__init__(name="capture-daemon", daemon=True)
+        self.fps = fps
+        self.max_cpu_percent = max_cpu_percent
+        self.monitor_index = monitor_index
+
+        monitor = get_monitors()[monitor_index]
+        slot_bytes = monitor["width"] * monitor["height"] * 4
+        max_slots = int(max_memory_mb * 1024 * 1024 // slot_bytes)
+        if max_slots < 1:
+            raise ValueError(
+                f"max_memory_mb={max_memory_mb} cannot hold a single {monitor['width']}x{monitor['height']} frame"
+            )
+        self.buffer = FrameRingBuffer(min(slot_count, max_slots), slot_bytes)
+        self.dropped_frames = 0
+        self.last_grab_seconds = 0.0
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        min_period = 1.0 / self.fps if self.fps > 0 else 0.0
+        consecutive_failures = 0
+        while not self._stop_event.is_set():
+            started = time.perf_counter()
+            try:
+                if not self.buffer.write(grab_monitor(self.monitor_index)):
+                    # 螢幕解析度變大時畫面放不進 slot
+                    self.dropped_frames += 1
+                consecutive_failures = 0
+            except Exception as e:
+                self.dropped_frames += 1
+                # 螢幕鎖定或斷線時每次擷取都會失敗；stdout 是 MCP 的 stdio 通道，記錄寫到 stderr 且不洗版
+                if consecutive_failures % _GRAB_FAILURE_LOG_INTERVAL == 0:
+                    print(f"Capture daemon grab failed ({consecutive_failures + 1} in a row): {type(e).__name__} - {e}",
+                          file=sys.stderr)
+                consecutive_failures += 1
+            self.last_grab_seconds = time.perf_counter() - started
+            period = max(min_period, self.last_grab_seconds * 100.0 / max(self.max_cpu_percent, 1.0))
+            self._stop_event.wait(max(period - self.last_grab_seconds, 0.0))
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join(timeout=2.0)
+        self.buffer.close()
+
+    def status(self) -> dict:
+        return {
+            "running": self.is_alive(),
+            "fps": self.fps,
+            "max_cpu_percent": self.max_cpu_percent,
+            "slots": self.buffer.slot_count,
+            "buffer_bytes": self.buffer.nbytes,
+            "shared_memory_name": self.buffer.name,
+            "frames_written": self.buffer.frames_written,
+            "dropped_frames": self.dropped_frames,
+            "last_grab_ms": round(self.last_grab_seconds * 1000, 3),
+        }
+
+
+_daemon: Optional[CaptureDaemon] = None
+
+
+def start_capture_daemon(**kwargs) -> CaptureDaemon:
+    """Starts the process-wide capture daemon (no-op if it is already running)."""
+    global _daemon
+    if _daemon is None or not _daemon.is_alive():
+        _daemon = CaptureDaemon(**kwargs)
+        _daemon.start()
+    return _daemon
+
+
+def start_capture_daemon_from_env() -> Optional[CaptureDaemon]:
+    """
+    Starts the capture daemon if MCP_CAPTURE_DAEMON=1. Caps are read from
+    MCP_CAPTURE_FPS, MCP_CAPTURE_SLOTS, MCP_CAPTURE_MAX_MEMORY_MB and MCP_CAPTURE_MAX_CPU_PERCENT.
+    """
+    if os.getenv("MCP_CAPTURE_DAEMON", "0") != "1":
+        return None
+    try:
+        return start_capture_daemon(
+            fps=float(os.getenv("MCP_CAPTURE_FPS", "10")),
+            slot_count=int(os.getenv("MCP_CAPTURE_SLOTS", "8")),
+            max_memory_mb=float(os.getenv("MCP_CAPTURE_MAX_MEMORY_MB", "256")),
+            max_cpu_percent=float(os.getenv("MCP_CAPTURE_MAX_CPU_PERCENT", "50")),
+        )
+    except Exception as e:
+        print(f"Error starting capture daemon: {type(e).__name__} - {e}", file=sys.stderr)
+        return None
+
+
+def stop_capture_daemon() -> None:
+    """Stops the capture daemon and unlinks its shared memory block. Also runs at interpreter exit."""
+    global _daemon
+    if _daemon is not None:
+        _daemon.stop()
+        _daemon = None
+
+
+# 伺服器結束時 (mcp.run 返回或 stdin 關閉) 釋放共享記憶體，避免 resource_tracker 回報洩漏
+atexit.register(stop_capture_daemon)
+
+
+def get_capture_daemon() -> Optional[CaptureDaemon]:
+    """Returns the running capture daemon, or None if frames are grabbed on demand."""
+    if _daemon is not None and _daemon.is_alive():
+        return _daemon
+    return None
+
+
+def get_buffered_frame(frame_timestamp: Optional[float] = None, copy: bool = False) -> Optional[Frame]:
+    """
+    Reads a frame from the capture daemon: the latest one, or the first one captured at or
+    after frame_timestamp. Returns None if the daemon is not running or has no matching frame
+    yet, in which case callers should grab the screen directly. By default the frame is a
+    zero-copy view; pass copy=True when the pixels are used after the writer may wrap around.
+    """
+    daemon = get_capture_daemon()
+    if daemon is None:
+        return None
+    if frame_timestamp is None:
+        return daemon.buffer.latest(copy)
+    return daemon.buffer.at_or_after(frame_timestamp, copy)
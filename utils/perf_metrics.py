@@ -0,0 +1,154 @@
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Optional
+
+from pydantic import BaseModel
+
+# 直方圖的桶上界 (毫秒)，最後一個桶收集超過 30 秒的樣本
+HISTOGRAM_BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000)
+# 百分位數以每個階段最近的這麼多個樣本計算
+RECENT_SAMPLES = 1024
+
+
+class HistogramBucket(BaseModel):
+    le_ms: Optional[float] # 桶上界；None 表示超過最大上界
+    count: int
+
+
+class StageMetrics(BaseModel):
+    stage: str
+    count: int
+    errors: int # 以例外結束的 span 數
+    total_ms: float
+    mean_ms: float
+    min_ms: float
+    max_ms: float
+    p50_ms: float
+    p90_ms: float
+    p99_ms: float
+    histogram: list[HistogramBucket] # 只列出非空的桶
+
+
+class PerformanceSnapshot(BaseModel):
+    enabled: bool
+    since: float # 開始統計 (或上次重設) 的時間 (time.time())
+    stages: list[StageMetrics]
+    counters: dict[str, float]
+
+
+class _Stage:
+    __slots__ = ("count", "errors", "total", "minimum", "maximum", "buckets", "recent")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.minimum = float("inf")
+        self.maximum = 0.0
+        self.buckets = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+
+    def add(self, ms: float, error: bool) -> None:
+        self.count += 1
+        self.errors += error
+        self.total += ms
+        self.minimum = min(self.minimum, ms)
+        self.maximum = max(self.maximum, ms)
+        index = 0
+        while index < len(HISTOGRAM_BOUNDS_MS) and ms > HISTOGRAM_BOUNDS_MS[index]:
+            index += 1
+        self.buckets[index] += 1
+        self.recent.append(ms)
+
+    def to_metrics(self, stage: str) -> StageMetrics:
+        samples = sorted(self.recent)
+
+        def percentile(fraction: float) -> float:
+            return round(samples[min(len(samples) - 1, int(fraction * len(samples)))], 3)
+
+        return StageMetrics(
+            stage=stage,
+            count=self.count,
+            errors=self.errors,
+            total_ms=round(self.total, 3),
+            mean_ms=round(self.total / self.count, 3),
+            min_ms=round(self.minimum, 3),
+            max_ms=round(self.maximum, 3),
+            p50_ms=percentile(0.5),
+            p90_ms=percentile(0.9),
+            p99_ms=percentile(0.99),
+            histogram=[
+                HistogramBucket(le_ms=HISTOGRAM_BOUNDS_MS[i] if i < len(HISTOGRAM_BOUNDS_MS) else None, count=count)
+                for i, count in enumerate(self.buckets) if count
+            ],
+        )
+
+
+class PerformanceRecorder:
+    """
+    Process-wide latency histograms and counters. Spans are recorded from the event loop as well as
+    from the capture, input and preprocessing threads, so every update takes a lock.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._stages: dict[str, _Stage] = {}
+        self._counters: dict[str, float] = {}
+        self._since = time.time()
+
+    def record(self, stage: str, ms: float, error: bool = False) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            entry = self._stages.get(stage)
+            if entry is None:
+                entry = self._stages[stage] = _Stage()
+            entry.add(ms, error)
+
+    def increment(self, counter: str, amount: float = 1) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[counter] = self._counters.get(counter, 0) + amount
+
+    @contextmanager
+    def span(self, stage: str):
+        """Times the enclosed block (sync code or code that awaits) as one sample of stage."""
+        started = time.perf_counter()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.record(stage, (time.perf_counter() - started) * 1000, error)
+
+    def snapshot(self, stage_prefix: Optional[str] = None) -> PerformanceSnapshot:
+        with self._lock:
+            stages = [
+                entry.to_metrics(stage) for stage, entry in sorted(self._stages.items())
+                if stage_prefix is None or stage.startswith(stage_prefix)
+            ]
+            counters = {
+                name: value for name, value in sorted(self._counters.items())
+                if stage_prefix is None or name.startswith(stage_prefix)
+            }
+            return PerformanceSnapshot(enabled=self.enabled, since=self._since, stages=stages, counters=counters)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stages.clear()
+            self._counters.clear()
+            self._since = time.time()
+
+
+# 整個行程共用的記錄器；MCP_METRICS=0 可停用
+metrics = PerformanceRecorder(enabled=os.getenv("MCP_METRICS", "1") != "0")
+span = metrics.span
+record = metrics.record
+increment = metrics.increment
@@ -0,0 +1,275 @@
+import math
+from collections import deque
+from typing import Literal, Optional
+
+import numpy as np
+from pydantic import BaseModel
+
+from utils.bounds import SubAreaBounds
+
+RegionKind = Literal["panel", "text", "button", "element"]
+
+
+class RegionProposal(BaseModel):
+    bounds: SubAreaBounds
+    kind: RegionKind
+    score: float # 0-1，越高越可能是有意義的 UI 區域
+    edge_density: float # 區域內邊緣像素的比例
+
+
+def bgra_to_gray(bgra: np.ndarray) -> np.ndarray:
+    """(h, w, 4) BGRA -> (h, w) uint8 luma with integer BT.601 weights."""
+    pixels = bgra.astype(np.uint16)
+    return ((pixels[..., 0] * 29 + pixels[..., 1] * 150 + pixels[..., 2] * 77) >> 8).astype(np.uint8)
+
+
+def edge_mask(gray: np.ndarray, threshold: int = 24) -> np.ndarray:
+    """Marks pixels whose horizontal or vertical neighbour differs by more than threshold."""
+    values = gray.astype(np.int16)
+    edges = np.zeros(gray.shape, dtype=bool)
+    edges[:, 1:] |= np.abs(values[:, 1:] - values[:, :-1]) > threshold
+    edges[1:, :] |= np.abs(values[1:, :] - values[:-1, :]) > threshold
+    return edges
+
+
+def _line_runs(edges: np.ndarray, length: int) -> np.ndarray:
+    """Marks edge pixels that belong to a horizontal run of at least length pixels (vectorized with cumsums)."""
+    width = edges.shape[1]
+    if width < length:
+        return np.zeros_like(edges)
+    cumulative = np.zeros((edges.shape[0], width + 1), dtype=np.int32)
+    np.cumsum(edges, axis=1, out=cumulative[:, 1:])
+    # full_start[:, j]: edges[:, j:j + length] 全為邊緣
+    full_start = (cumulative[:, length:] - cumulative[:, :-length]) == length
+    starts = np.zeros((edges.shape[0], width + 1), dtype=np.int32)
+    np.cumsum(full_start, axis=1, out=starts[:, 1:width - length + 2])
+    starts[:, width - length + 2:] = starts[:, width - length + 1:width - length + 2]
+    # 像素 j 落在某個完整視窗內 <=> [j - length + 1, j] 之間有起點
+    runs = np.empty(edges.shape, dtype=bool)
+    runs[:, :length - 1] = starts[:, 1:length] > 0
+    runs[:, length - 1:] = starts[:, length:] > starts[:, :width - length + 1]
+    return runs
+
+
+def separator_mask(edges: np.ndarray, length: int) -> np.ndarray:
+    """Straight horizontal or vertical edge runs of at least length pixels (panel borders, rules, bars)."""
+    separators = np.zeros_like(edges)
+    # 只有邊緣像素數量達到 length 的列/行才可能含有分隔線，其餘不必計算
+    rows = np.flatnonzero(np.count_nonzero(edges, axis=1) >= length)
+    if rows.size:
+        separators[rows] = _line_runs(edges[rows], length)
+    cols = np.flatnonzero(np.count_nonzero(edges, axis=0) >= length)
+    if cols.size:
+        separators[:, cols] |= _line_runs(np.ascontiguousarray(edges[:, cols].T), length).T
+    return separators
+
+
+def _cell_counts(edges: np.ndarray, cell_size: int) -> np.ndarray:
+    height, width = edges.shape
+    rows, cols = -(-height // cell_size), -(-width // cell_size)
+    padded = np.zeros((rows * cell_size, cols * cell_size), dtype=np.uint16)
+    padded[:height, :width] = edges
+    return padded.reshape(rows, cell_size, cols, cell_size).sum(axis=(1, 3))
+
+
+def _tighten(mask: np.ndarray, box: tuple[int, int, int, int]) -> tuple[int, int, int, int] | None:
+    r0, r1, c0, c1 = box
+    sub = mask[r0:r1, c0:c1]
+    rows = np.flatnonzero(sub.any(axis=1))
+    if rows.size == 0:
+        return None
+    cols = np.flatnonzero(sub.any(axis=0))
+    return r0 + int(rows[0]), r0 + int(rows[-1]) + 1, c0 + int(cols[0]), c0 + int(cols[-1]) + 1
+
+
+def _segments(profile: np.ndarray, min_gap: int) -> list[tuple[int, int]]:
+    """Splits a 1-D occupancy profile at runs of at least min_gap empty cells."""
+    occupied = np.flatnonzero(profile)
+    breaks = np.flatnonzero(np.diff(occupied) > min_gap)
+    starts = np.r_[occupied[0], occupied[breaks + 1]]
+    ends = np.r_[occupied[breaks], occupied[-1]] + 1
+    return list(zip(starts.tolist(), ends.tolist()))
+
+
+def xy_cut(mask: np.ndarray, min_gap: int, max_depth: int = 8) -> list[tuple[int, int, int, int]]:
+    """
+    Recursive XY-cut: splits the cell grid at whitespace bands (rows first, then columns) until
+    no band of at least min_gap empty cells remains. Returns (r0, r1, c0, c1) leaf blocks.
+    """
+    leaves = []
+    stack = [((0, mask.shape[0], 0, mask.shape[1]), 0)]
+    while stack:
+        box, depth = stack.pop()
+        box = _tighten(mask, box)
+        if box is None:
+            continue
+        r0, r1, c0, c1 = box
+        if depth < max_depth:
+            row_segments = _segments(mask[r0:r1, c0:c1].any(axis=1), min_gap)
+            if len(row_segments) > 1:
+                stack.extend(((r0 + s, r0 + e, c0, c1), depth + 1) for s, e in row_segments)
+                continue
+            col_segments = _segments(mask[r0:r1, c0:c1].any(axis=0), min_gap)
+            if len(col_segments) > 1:
+                stack.extend(((r0, r1, c0 + s, c0 + e), depth + 1) for s, e in col_segments)
+                continue
+        leaves.append(box)
+    return leaves
+
+
+def connected_boxes(mask: np.ndarray) -> list[tuple[int, int, int, int]]:
+    """Bounding boxes (r0, r1, c0, c1) of 8-connected components of the cell grid."""
+    rows, cols = mask.shape
+    visited = np.zeros_like(mask)
+    boxes = []
+    for start_row, start_col in np.argwhere(mask):
+        if visited[start_row, start_col]:
+            continue
+        min_r = max_r = int(start_row)
+        min_c = max_c = int(start_col)
+        queue = deque([(int(start_row), int(start_col))])
+        visited[start_row, start_col] = True
+        while queue:
+            r, c = queue.popleft()
+            min_r, max_r = min(min_r, r), max(max_r, r)
+            min_c, max_c = min(min_c, c), max(max_c, c)
+            for nr in range(max(r - 1, 0), min(r + 2, rows)):
+                for nc in range(max(c - 1, 0), min(c + 2, cols)):
+                    if mask[nr, nc] and not visited[nr, nc]:
+                        visited[nr, nc] = True
+                        queue.append((nr, nc))
+        boxes.append((min_r, max_r + 1, min_c, max_c + 1))
+    return boxes
+
+
+def quadtree_refine(mask: np.ndarray, box: tuple[int, int, int, int], max_cells: int,
+                    min_side: int) -> list[tuple[int, int, int, int]]:
+    """
+    Splits a box larger than max_cells into quadrants (only along sides longer than 2 * min_side),
+    tightening each quadrant to its content and dropping empty ones, until every box fits.
+    """
+    result = []
+    stack = [box]
+    while stack:
+        tight = _tighten(mask, stack.pop())
+        if tight is None:
+            continue
+        r0, r1, c0, c1 = tight
+        split_rows = r1 - r0 >= 2 * min_side
+        split_cols = c1 - c0 >= 2 * min_side
+        if (r1 - r0) * (c1 - c0) <= max_cells or not (split_rows or split_cols):
+            result.append(tight)
+            continue
+        row_edges = [r0, (r0 + r1) // 2, r1] if split_rows else [r0, r1]
+        col_edges = [c0, (c0 + c1) // 2, c1] if split_cols else [c0, c1]
+        for top, bottom in zip(row_edges, row_edges[1:]):
+            for left, right in zip(col_edges, col_edges[1:]):
+                stack.append((top, bottom, left, right))
+    return result
+
+
+def _has_border(region_edges: np.ndarray, coverage: float = 0.6) -> bool:
+    """True when edges cover most of all four sides of the (tight) box, i.e. an outlined or filled control."""
+    if min(region_edges.shape) < 3:
+        return False
+    sides = (region_edges[:2].any(axis=0), region_edges[-2:].any(axis=0),
+             region_edges[:, :2].any(axis=1), region_edges[:, -2:].any(axis=1))
+    return all(side.mean() >= coverage for side in sides)
+
+
+def _classify(region_edges: np.ndarray, frame_area: int) -> RegionKind:
+    height, width = region_edges.shape
+    if 12 <= height <= 80 and 24 <= width <= 320 and width <= 8 * height and _has_border(region_edges):
+        return "button"
+    # 文字區塊: 每一列內容帶 (由空白列分開) 都不超過一般行高
+    row_runs = _segments(region_edges.any(axis=1), 1) if region_edges.any() else []
+    line_heights = [end - start for start, end in row_runs]
+    if line_heights and max(line_heights) <= 32 and (len(line_heights) >= 2 or width >= 3 * height):
+        return "text"
+    if width * height >= frame_area // 60 and min(width, height) >= 96:
+        return "panel"
+    return "element"
+
+
+def _iou(a: SubAreaBounds, b: SubAreaBounds) -> float:
+    x0, y0 = max(a.x, b.x), max(a.y, b.y)
+    x1, y1 = min(a.x + a.width, b.x + b.width), min(a.y + a.height, b.y + b.height)
+    inter = max(0, x1 - x0) * max(0, y1 - y0)
+    union = a.width * a.height + b.width * b.height - inter
+    return inter / union if union else 0.0
+
+
+def propose_regions(gray: np.ndarray, edge_threshold: int = 24, cell_size: int = 8, min_gap: int = 16,
+                    max_region_fraction: float = 0.25, min_size: int = 12, padding: int = 2,
+                    separator_length: Optional[int] = None,
+                    max_proposals: int = 40, kinds: Optional[list[RegionKind]] = None) -> list[RegionProposal]:
+    """
+    Proposes UI regions in a grayscale screenshot without calling a model.
+
+    Edges are found with a vectorized neighbour-difference threshold. Straight runs of at least
+    separator_length pixels (default: a quarter of the shorter side, at least 128) are treated as
+    separators, i.e. like whitespace, and the remaining content edges are pooled into a grid of
+    cell_size pixel cells. Candidates come from three sources: XY-cut leaves at a coarse and a fine
+    gap (blocks separated by at least 4 * min_gap or min_gap pixels of whitespace: panels, paragraphs) and 8-connected components
+    of the edge cells (buttons, icons, text lines). Candidates larger than max_region_fraction of the
+    screen are refined with an adaptive quadtree. Boxes are tightened back to pixel precision, then
+    each proposal is classified by shape, scored by
+    edge density weighted by size, de-duplicated (IoU > 0.8) and the best max_proposals (optionally only
+    of the given kinds) are returned in the pixel coordinates of gray.
+    """
+    height, width = gray.shape
+    edges = edge_mask(gray, edge_threshold)
+    if separator_length is None:
+        separator_length = max(128, min(height, width) // 4)
+    edges &= ~separator_mask(edges, separator_length)
+    counts = _cell_counts(edges, cell_size)
+    mask = counts > 0
+    if not mask.any():
+        return []
+
+    gap_cells = max(1, min_gap // cell_size)
+    max_cells = max(1, int(mask.size * max_region_fraction))
+    min_side = max(1, math.ceil(min_size / cell_size))
+
+    # 粗的 XY-cut (較寬的空白) 得到面板，細的得到段落與控制項群組，連通元件得到單一控制項與文字行
+    candidates = xy_cut(mask, gap_cells * 4) + xy_cut(mask, gap_cells) + connected_boxes(mask)
+    refined = []
+    for box in candidates:
+        refined.extend(quadtree_refine(mask, box, max_cells, min_side))
+
+    proposals = []
+    for r0, r1, c0, c1 in sorted(set(refined)):
+        # 格子座標 -> 像素座標，再收緊到實際的邊緣像素
+        tight = _tighten(edges, (r0 * cell_size, r1 * cell_size, c0 * cell_size, c1 * cell_size))
+        if tight is None:
+            continue
+        kind = _classify(edges[tight[0]:tight[1], tight[2]:tight[3]], width * height)
+        if kinds and kind not in kinds:
+            continue
+        x0 = max(tight[2] - padding, 0)
+        y0 = max(tight[0] - padding, 0)
+        x1 = min(tight[3] + padding, width)
+        y1 = min(tight[1] + padding, height)
+        if x1 - x0 < min_size or y1 - y0 < min_size:
+            continue
+        area = (x1 - x0) * (y1 - y0)
+        density = float(counts[r0:r1, c0:c1].sum()) / area
+        # 邊緣密度乘上尺寸權重：太小的雜訊與大片空白都排在後面
+        size_weight = min(1.0, math.sqrt(area) / 64.0)
+        proposals.append(RegionProposal(
+            bounds=SubAreaBounds(x=x0, y=y0, width=x1 - x0, height=y1 - y0),
+            kind=kind,
+            score=min(1.0, 4 * density) * size_weight,
+            edge_density=round(density, 4),
+        ))
+
+    proposals.sort(key=lambda p: p.score, reverse=True)
+    kept: list[RegionProposal] = []
+    for proposal in proposals:
+        if all(_iou(proposal.bounds, other.bounds) <= 0.8 for other in kept):
+            kept.append(proposal)
+            if len(kept) >= max_proposals:
+                break
+    for proposal in kept:
+        proposal.score = round(proposal.score, 4)
+    return kept
@@ -0,0 +1,153 @@
+import asyncio
+import os
+import random
+import sys
+import time
+from typing import Awaitable, Callable, Hashable, Optional, TypeVar
+
+from utils.perf_metrics import increment
+
+T = TypeVar("T")
+
+# 可重試的 HTTP 狀態碼：速率限制與暫時性的伺服器錯誤
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class SchedulerConfig:
+    """Fan-out settings for model calls. Defaults can be overridden with GENAI_* environment variables."""
+
+    def __init__(
+        self,
+        max_concurrency: Optional[int] = None,
+        requests_per_minute: Optional[float] = None,
+        request_timeout: Optional[float] = None,
+        max_retries: Optional[int] = None,
+        backoff_base: float = 0.5,
+        backoff_max: float = 20.0,
+    ):
+        if max_concurrency is None:
+            max_concurrency = int(os.getenv("GENAI_MAX_CONCURRENCY", "8"))
+        if requests_per_minute is None:
+            requests_per_minute = float(os.getenv("GENAI_REQUESTS_PER_MINUTE", "0"))
+        if request_timeout is None:
+            request_timeout = float(os.getenv("GENAI_REQUEST_TIMEOUT", "60"))
+        if max_retries is None:
+            max_retries = int(os.getenv("GENAI_MAX_RETRIES", "3"))
+        self.max_concurrency = max(1, max_concurrency)
+        self.requests_per_minute = requests_per_minute  # 0 表示不限制
+        self.request_timeout = request_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+
+class TokenBucket:
+    """
+    Asyncio token bucket for requests per minute. One bucket is shared by every caller in the
+    process so concurrent tool calls cannot exceed the quota together.
+    It only touches its state between awaits, so it needs no lock on a single event loop.
+    """
+
+    def __init__(self, requests_per_minute: float, burst: Optional[float] = None):
+        self.requests_per_minute = requests_per_minute
+        self.capacity = burst if burst is not None else max(1.0, requests_per_minute / 60.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+
+    async def acquire(self) -> None:
+        if self.requests_per_minute <= 0:
+            return
+        rate_per_second = self.requests_per_minute / 60.0
+        while True:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * rate_per_second)
+            self._updated = now
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return
+            await asyncio.sleep((1.0 - self._tokens) / rate_per_second)
+
+
+def get_status_code(error: BaseException) -> Optional[int]:
+    """Extracts an HTTP status code from SDK (google.genai APIError.code) or httpx errors."""
+    for attr in ("code", "status_code"):
+        value = getattr(error, attr, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(error, "response", None)
+    value = getattr(response, "status_code", None)
+    return value if isinstance(value, int) else None
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, asyncio.TimeoutError):
+        return True
+    return get_status_code(error) in RETRYABLE_STATUS_CODES
+
+
+async def call_with_retries(
+    fn: Callable[[], Awaitable[T]],
+    config: SchedulerConfig,
+    bucket: Optional[TokenBucket] = None,
+) -> T:
+    """
+    Runs fn with a per-attempt timeout, retrying 429/5xx/timeouts with exponential backoff
+    and full jitter. Every attempt (including retries) takes a token from the bucket.
+    """
+    attempt = 0
+    while True:
+        if bucket is not None:
+            await bucket.acquire()
+        try:
+            return await asyncio.wait_for(fn(), timeout=config.request_timeout)
+        except Exception as e:
+            if attempt >= config.max_retries or not is_retryable(e):
+                raise
+            delay = random.uniform(0, min(config.backoff_max, config.backoff_base * (2 ** attempt)))
+            attempt += 1
+            increment("genai.retries")
+            # stdout 是 MCP 的 stdio 通道，記錄訊息寫到 stderr
+            print(f"Retrying model call (attempt {attempt}/{config.max_retries}) after {type(e).__name__} in {delay:.2f}s", file=sys.stderr)
+            await asyncio.sleep(delay)
+
+
+async def gather_bounded(
+    keys: list[Hashable],
+    worker: Callable[[Hashable], Awaitable[T]],
+    max_concurrency: int,
+) -> dict[Hashable, T]:
+    """Runs worker(key) for every key with at most max_concurrency in flight; results are keyed by key."""
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run(key):
+        async with semaphore:
+            return key, await worker(key)
+
+    pairs = await asyncio.gather(*(run(key) for key in keys))
+    return dict(pairs)
+
+
+# 範例 (供本地量測，不需要 API 金鑰): python -m utils.request_scheduler
+async def main_test(image_count: int = 16, latency: float = 0.2):
+    async def fake_backend(key):
+        await asyncio.sleep(latency)
+        return f"description of {key}"
+
+    keys = [f"image_{i}.png" for i in range(image_count)]
+
+    started = time.perf_counter()
+    for key in keys:
+        await fake_backend(key)
+    sequential = time.perf_counter() - started
+
+    config = SchedulerConfig(max_concurrency=8)
+    started = time.perf_counter()
+    await gather_bounded(keys, lambda key: call_with_retries(lambda: fake_backend(key), config), config.max_concurrency)
+    concurrent = time.perf_counter() - started
+
+    print(f"{image_count} calls at {latency * 1000:.0f} ms: sequential {sequential:.2f}s, "
+          f"concurrent (limit {config.max_concurrency}) {concurrent:.2f}s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main_test())
@@ -0,0 +1,225 @@
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+from PIL import Image as PillowImage
+
+from utils.path_utils import _normalize_path
+from utils.tmp_retention import enforce_retention
+
+# 磁碟層寫入後最多每這麼多秒清理一次目錄 (掃描目錄的成本與檔案數成正比)
+_DISK_PRUNE_INTERVAL_SECONDS = 60.0
+
+
+def image_content_hash(image: PillowImage.Image) -> str:
+    """Hashes decoded pixels, so the same screen content hits regardless of file name or encoder settings."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+def perceptual_hash(image: PillowImage.Image) -> int:
+    """64-bit difference hash (dHash): robust to tiny rendering differences such as a blinking caret."""
+    small = image.convert("L").resize((9, 8), PillowImage.Resampling.BILINEAR)
+    pixels = small.tobytes()
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return bits
+
+
+class CacheStats:
+    def __init__(self):
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.perceptual_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def as_dict(self) -> dict:
+        hits = self.memory_hits + self.disk_hits + self.perceptual_hits
+        total = hits + self.misses
+        return {
+            "hits": hits,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "perceptual_hits": self.perceptual_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(hits / total, 4) if total else 0.0,
+        }
+
+
+class ResponseCache:
+    """
+    Content-addressed cache of model responses keyed by (model, prompt, image content hash).
+
+    Tier 1 is an in-memory LRU bounded by entry count and TTL. Tier 2 is an optional
+    directory of JSON files that survives restarts, pruned by age and total size after
+    writes; get and put can point it at a per-call directory. With phash_max_distance > 0, a miss
+    falls back to the closest cached image for the same model and prompt whose perceptual
+    hash is within that Hamming distance. The cache is thread-safe.
+    """
+
+    def __init__(self, max_entries: int = 512, ttl_seconds: float = 600.0, disk_dir: Optional[Path] = None,
+                 disk_ttl_seconds: float = 86400.0, disk_max_bytes: int = 64 * 1024 * 1024,
+                 phash_max_distance: int = 0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.disk_dir = disk_dir
+        self.disk_ttl_seconds = disk_ttl_seconds
+        self.disk_max_bytes = disk_max_bytes
+        self.phash_max_distance = phash_max_distance
+        self.stats = CacheStats()
+        # key -> (created, text, scope, phash)
+        self._entries: OrderedDict[str, tuple[float, str, str, Optional[int]]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_prune: dict[Path, float] = {}
+
+    @staticmethod
+    def make_key(model: str, prompt: str, content_hash: str) -> str:
+        return hashlib.blake2b(f"{model}\0{prompt}\0{content_hash}".encode(), digest_size=20).hexdigest()
+
+    @staticmethod
+    def make_scope(model: str, prompt: str) -> str:
+        return hashlib.blake2b(f"{model}\0{prompt}".encode(), digest_size=12).hexdigest()
+
+    def get(self, model: str, prompt: str, content_hash: str, phash: Optional[int] = None,
+            disk_dir: Optional[Path] = None) -> Optional[str]:
+        key = self.make_key(model, prompt, content_hash)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[0] <= self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self.stats.memory_hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+
+        text = self._read_disk(disk_dir or self.disk_dir, key, now)
+        if text is not None:
+            with self._lock:
+                self.stats.disk_hits += 1
+            self._store_memory(key, text, self.make_scope(model, prompt), phash, now)
+            return text
+
+        if phash is not None and self.phash_max_distance > 0:
+            text = self._find_similar(self.make_scope(model, prompt), phash, now)
+            if text is not None:
+                with self._lock:
+                    self.stats.perceptual_hits += 1
+                return text
+
+        with self._lock:
+            self.stats.misses += 1
+        return None
+
+    def put(self, model: str, prompt: str, content_hash: str, text: str, phash: Optional[int] = None,
+            disk_dir: Optional[Path] = None) -> None:
+        key = self.make_key(model, prompt, content_hash)
+        now = time.time()
+        scope = self.make_scope(model, prompt)
+        self._store_memory(key, text, scope, phash, now)
+        disk_dir = disk_dir or self.disk_dir
+        if disk_dir is not None:
+            try:
+                disk_dir.mkdir(parents=True, exist_ok=True)
+                payload = {"created": now, "text": text, "scope": scope, "phash": phash}
+                temp_path = disk_dir / f"{key}.json.tmp"
+                temp_path.write_text(json.dumps(payload), encoding="utf-8")
+                os.replace(temp_path, disk_dir / f"{key}.json")  # 原子性取代，避免讀到寫一半的檔案
+            except OSError as e:
+                print(f"Error writing response cache entry: {e}", file=sys.stderr) # stdout 是 MCP 的 stdio 通道
+                return
+            self._prune_disk(disk_dir, now)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def _store_memory(self, key: str, text: str, scope: str, phash: Optional[int], now: float) -> None:
+        with self._lock:
+            self._entries[key] = (now, text, scope, phash)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats.evictions += 1
+
+    def _prune_disk(self, disk_dir: Path, now: float) -> None:
+        # 過期的項目只有被讀到時才會刪除，因此定期依存活時間與總大小清理
+        with self._lock:
+            if now - self._last_prune.get(disk_dir, 0.0) < _DISK_PRUNE_INTERVAL_SECONDS:
+                return
+            self._last_prune[disk_dir] = now
+        enforce_retention(disk_dir, max_bytes=self.disk_max_bytes, max_age_seconds=self.disk_ttl_seconds)
+
+    def _read_disk(self, disk_dir: Optional[Path], key: str, now: float) -> Optional[str]:
+        if disk_dir is None:
+            return None
+        path = disk_dir / f"{key}.json"
+        try:
+            payload = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        if now - payload.get("created", 0) > self.disk_ttl_seconds:
+            try:
+                path.unlink()
+            except OSError:
+                pass
+            return None
+        return payload.get("text")
+
+    def _find_similar(self, scope: str, phash: int, now: float) -> Optional[str]:
+        best_text, best_distance = None, self.phash_max_distance + 1
+        with self._lock:
+            for created, text, entry_scope, entry_phash in self._entries.values():
+                if entry_scope != scope or entry_phash is None or now - created > self.ttl_seconds:
+                    continue
+                distance = bin(entry_phash ^ phash).count("1")
+                if distance < best_distance:
+                    best_text, best_distance = text, distance
+        return best_text
+
+
+def disk_cache_dir(current_working_dir: Optional[str]) -> Optional[Path]:
+    """
+    Directory of the disk tier for a call: GENAI_CACHE_DIR if set, otherwise tmp/genai_cache
+    under the caller's current_working_dir (the server's own working directory is often / or
+    system32). None if GENAI_DISK_CACHE is off or the call has no working directory.
+    """
+    if os.getenv("GENAI_DISK_CACHE", "0") != "1":
+        return None
+    if os.getenv("GENAI_CACHE_DIR"):
+        return Path(os.environ["GENAI_CACHE_DIR"])
+    if not current_working_dir:
+        return None
+    return _normalize_path(current_working_dir) / "tmp" / "genai_cache"
+
+
+def response_cache_from_env() -> Optional[ResponseCache]:
+    """
+    Builds the process-wide cache from GENAI_CACHE* environment variables, or returns None
+    if GENAI_CACHE=0. The disk tier (GENAI_DISK_CACHE=1) is located per call by disk_cache_dir
+    and capped by GENAI_DISK_CACHE_TTL and GENAI_DISK_CACHE_MAX_BYTES.
+    """
+    if os.getenv("GENAI_CACHE", "1") != "1":
+        return None
+    return ResponseCache(
+        max_entries=int(os.getenv("GENAI_CACHE_MAX_ENTRIES", "512")),
+        ttl_seconds=float(os.getenv("GENAI_CACHE_TTL", "600")),
+        disk_ttl_seconds=float(os.getenv("GENAI_DISK_CACHE_TTL", "86400")),
+        disk_max_bytes=int(os.getenv("GENAI_DISK_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+        phash_max_distance=int(os.getenv("GENAI_CACHE_PHASH_DISTANCE", "0")),
+    )
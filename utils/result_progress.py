@@ -0,0 +1,44 @@
+import sys
+import time
+from typing import Optional
+
+
+class ResultProgress:
+    """
+    Forwards per-item results of a multi-item call to the MCP client as progress notifications
+    while the rest are still in flight, and records the time to the first result.
+    ctx is the tool's FastMCP Context, or None for Python callers (only the timing is kept).
+    """
+
+    def __init__(self, ctx=None, total: int = 0):
+        self.ctx = ctx
+        self.total = total
+        self.done = 0
+        self.started = time.perf_counter()
+        self.first_result_ms: Optional[float] = None
+
+    def elapsed_ms(self) -> float:
+        return round((time.perf_counter() - self.started) * 1000, 3)
+
+    async def result(self, key: str, text: Optional[str]) -> float:
+        """Reports one finished item and returns the time since the call started, in milliseconds."""
+        elapsed = self.elapsed_ms()
+        self.done += 1
+        if self.first_result_ms is None:
+            self.first_result_ms = elapsed
+            print(f"First result after {elapsed:.1f} ms ({key})", file=sys.stderr) # stdout 是 MCP 的 stdio 通道
+        if self.ctx is not None:
+            try:
+                await self.ctx.report_progress(self.done, self.total or None, message=f"{key} ({elapsed:.0f} ms): {text}")
+            except Exception as e:
+                # 通知失敗 (例如客戶端已斷線) 不影響其餘結果
+                print(f"Error sending progress notification: {e}", file=sys.stderr)
+        return elapsed
+
+    async def partial(self, key: str, text: str) -> None:
+        """Sends the text streamed so far for one item as a log notification (progress values must only grow)."""
+        if self.ctx is not None:
+            try:
+                await self.ctx.info(f"[partial] {key}: {text}")
+            except Exception as e:
+                print(f"Error sending partial result: {e}", file=sys.stderr)
@@ -0,0 +1,189 @@
+import asyncio
+import io
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Literal
+
+import numpy as np
+from PIL import Image as PillowImage
+
+if TYPE_CHECKING:
+    import mss.base # 只用於型別標註；執行時在第一次擷取才載入
+
+ImageFormat = Literal["png", "bmp", "jpeg", "webp", "raw"]
+
+FORMAT_EXTENSIONS = {
+    "png": "png",
+    "bmp": "bmp",
+    "jpeg": "jpg",
+    "webp": "webp",
+    "raw": "raw",
+}
+
+FORMAT_MIME_TYPES = {
+    "png": "image/png",
+    "bmp": "image/bmp",
+    "jpeg": "image/jpeg",
+    "webp": "image/webp",
+    "raw": "application/octet-stream",
+}
+
+# mss 的實例不可跨執行緒共用 (Windows 上綁定 DC，Linux 上綁定 X display)，
+# 因此每個執行緒各自保留一個長駐的 grabber。
+_thread_state = threading.local()
+
+# 所有擷取預設都在這個單一執行緒上進行，確保只會有一個長駐的 mss 實例，
+# 同時避免阻塞 MCP 的 event loop。
+_capture_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="screen-capture")
+
+# 多個擷取目標 (不同螢幕、區域、視窗) 同時擷取與編碼時使用的執行緒池，每個執行緒同樣各自保留 grabber
+_parallel_capture_executor = ThreadPoolExecutor(
+    max_workers=max(1, int(os.getenv("MCP_CAPTURE_PARALLELISM", "4"))),
+    thread_name_prefix="screen-capture-parallel",
+)
+
+
+class Frame:
+    """
+    A raw BGRA screen frame kept in memory, together with its position on the virtual screen.
+    bgra may be a bytes object or a memoryview into a shared buffer (see utils.frame_ring_buffer).
+
+    left and top are in screen coordinates (the ones control_input uses); scale is the number of
+    image pixels per screen coordinate unit (e.g. 2.0 on a Retina display), so image pixel (x, y)
+    is at screen point (left + x / scale, top + y / scale).
+    """
+
+    __slots__ = ("bgra", "width", "height", "left", "top", "timestamp", "scale")
+
+    def __init__(self, bgra: bytes | memoryview, width: int, height: int, left: int = 0, top: int = 0,
+                 timestamp: float | None = None, scale: float = 1.0):
+        self.bgra = bgra
+        self.width = width
+        self.height = height
+        self.left = left
+        self.top = top
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self.scale = scale
+
+    @property
+    def size(self) -> tuple[int, int]:
+        return self.width, self.height
+
+    def to_pil(self) -> PillowImage.Image:
+        """Converts the BGRA buffer to an RGB Pillow image (no file round-trip)."""
+        return PillowImage.frombytes("RGB", self.size, self.bgra, "raw", "BGRX")
+
+    def as_array(self) -> np.ndarray:
+        """Returns a (height, width, 4) BGRA view of the buffer without copying."""
+        return np.frombuffer(self.bgra, dtype=np.uint8).reshape(self.height, self.width, 4)
+
+    def to_screen(self, x: float, y: float) -> tuple[int, int]:
+        """Maps a pixel of this frame to screen coordinates usable as control_input x/y."""
+        return round(self.left + x / self.scale), round(self.top + y / self.scale)
+
+    def crop(self, x: int, y: int, width: int, height: int) -> "Frame":
+        """Returns a new frame holding a private copy of the given rectangle (frame coordinates)."""
+        region = self.as_array()[max(y, 0):y + height, max(x, 0):x + width]
+        left, top = self.to_screen(max(x, 0), max(y, 0))
+        return Frame(np.ascontiguousarray(region).tobytes(), region.shape[1], region.shape[0],
+                     left, top, self.timestamp, self.scale)
+
+    def crop_to_pil(self, x: int, y: int, width: int, height: int) -> PillowImage.Image:
+        """Crops in frame coordinates and converts only the cropped pixels to RGB."""
+        region = self.as_array()[max(y, 0):y + height, max(x, 0):x + width]
+        return PillowImage.fromarray(np.ascontiguousarray(region[..., 2::-1]))
+
+
+def _get_sct() -> "mss.base.MSSBase":
+    sct = getattr(_thread_state, "sct", None)
+    if sct is None:
+        import mss # 第一次擷取時才載入
+        sct = mss.mss()
+        _thread_state.sct = sct
+    return sct
+
+
+def get_monitors() -> list[dict]:
+    """Returns the mss monitor list (index 0 is the union of all monitors, 1 is the primary)."""
+    return list(_get_sct().monitors)
+
+
+def _grab(sct, area: dict) -> Frame:
+    sct_img = sct.grab(area)
+    # mss 的座標是邏輯座標，影像則是實體像素 (例如 Retina 螢幕為兩倍)，兩者的比例即 DPI 縮放
+    scale = sct_img.width / area["width"] if area["width"] else 1.0
+    return Frame(bytes(sct_img.bgra), sct_img.width, sct_img.height, area["left"], area["top"], scale=scale)
+
+
+def grab_monitor(monitor_index: int = 1) -> Frame:
+    """Grabs a whole monitor (0 = all monitors as one image) with the calling thread's long-lived grabber."""
+    sct = _get_sct()
+    if not 0 <= monitor_index < len(sct.monitors):
+        raise ValueError(f"Monitor {monitor_index} does not exist (available: 0-{len(sct.monitors) - 1}, 0 = all monitors)")
+    return _grab(sct, sct.monitors[monitor_index])
+
+
+def grab_region(left: int, top: int, width: int, height: int) -> Frame:
+    """Grabs an arbitrary rectangle given in virtual-screen coordinates."""
+    if width <= 0 or height <= 0:
+        raise ValueError(f"Invalid capture region size {width}x{height}")
+    return _grab(_get_sct(), {"left": left, "top": top, "width": width, "height": height})
+
+
+def find_window(title: str) -> tuple[int, int, int, int]:
+    """
+    Returns (left, top, width, height) of the first visible window whose title contains title.
+    Needs pygetwindow (installed with pyautogui on Windows; available on macOS).
+    """
+    try:
+        import pygetwindow # 只有以視窗為擷取目標時才載入
+    except ImportError:
+        raise ValueError("Window capture needs the 'pygetwindow' package (Windows/macOS); pass a region instead.")
+    for window in pygetwindow.getWindowsWithTitle(title):
+        if window.width > 0 and window.height > 0 and not getattr(window, "isMinimized", False):
+            return window.left, window.top, window.width, window.height
+    raise ValueError(f"No visible window with a title containing '{title}'")
+
+
+def encode_frame(frame: Frame, image_format: ImageFormat = "png", png_compress_level: int = 1, quality: int = 85) -> bytes:
+    """
+    Encodes a frame in memory.
+
+    "raw" returns the BGRA buffer untouched. PNG uses a low zlib level by default,
+    which is several times faster than mss.tools.to_png on large screens.
+    """
+    if image_format == "raw":
+        return frame.bgra
+
+    image = frame.to_pil()
+    buffer = io.BytesIO()
+    if image_format == "png":
+        image.save(buffer, format="PNG", compress_level=png_compress_level)
+    elif image_format == "bmp":
+        image.save(buffer, format="BMP")
+    elif image_format == "jpeg":
+        image.save(buffer, format="JPEG", quality=quality)
+    elif image_format == "webp":
+        image.save(buffer, format="WEBP", quality=quality, method=0)
+    else:
+        raise ValueError(f"Unsupported image format: {image_format}")
+    return buffer.getvalue()
+
+
+def run_in_capture_thread(fn, *args):
+    """Schedules fn on the dedicated capture thread and returns an awaitable future."""
+    return asyncio.get_running_loop().run_in_executor(_capture_executor, fn, *args)
+
+
+async def run_in_capture_threads(fn, args_list: list[tuple]) -> list:
+    """
+    Runs fn(*args) for every args tuple on the parallel capture pool (MCP_CAPTURE_PARALLELISM threads)
+    and returns the results in order; exceptions are returned in place of results.
+    """
+    loop = asyncio.get_running_loop()
+    return await asyncio.gather(
+        *(loop.run_in_executor(_parallel_capture_executor, fn, *args) for args in args_list),
+        return_exceptions=True,
+    )
@@ -0,0 +1,190 @@
+"""
+Local OpenAI-compatible vision endpoint for offline throughput and tail-latency tests.
+
+    python -m utils.stub_vision_server --port 8089 --latency-ms 300 --jitter-ms 100 --failure-rate 0.05
+
+Then point the server at it with GENAI_BACKEND=openai and OPENAI_BASE_URL=http://127.0.0.1:8089/v1.
+GET /stats returns request, connection and failure counters (connections < requests means keep-alive works).
+"""
+import argparse
+import base64
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+# 批次請求的標籤: multi_image 以 "R1:" 文字段落標示，contact_sheet 則列在提示中
+_LABEL_LIST_PATTERN = re.compile(r"label \(([^)]*)\)")
+
+
+class StubOptions:
+    def __init__(self, latency_ms: float = 200.0, jitter_ms: float = 0.0, failure_rate: float = 0.0,
+                 failure_status: int = 503, tail_rate: float = 0.0, tail_latency_ms: float = 2000.0,
+                 seed: Optional[int] = None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.failure_rate = failure_rate # 以 failure_status 回應的比例
+        self.failure_status = failure_status
+        self.tail_rate = tail_rate # 以 tail_latency_ms 回應的比例，用來量測尾端延遲
+        self.tail_latency_ms = tail_latency_ms
+        self.random = random.Random(seed)
+
+
+class _StubState:
+    def __init__(self, options: StubOptions):
+        self.options = options
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+        self.failures = 0
+
+    def as_dict(self) -> dict:
+        with self.lock:
+            return {"requests": self.requests, "connections": self.connections, "failures": self.failures}
+
+
+def _describe_image(url: str) -> str:
+    data = base64.b64decode(url.split(",", 1)[1]) if url.startswith("data:") else url.encode()
+    return f"stub description of image {hashlib.blake2b(data, digest_size=4).hexdigest()} ({len(data)} bytes)"
+
+
+def _answer(payload: dict) -> str:
+    content = payload["messages"][-1]["content"]
+    parts = content if isinstance(content, list) else [{"type": "text", "text": content}]
+    images = [part["image_url"]["url"] for part in parts if part.get("type") == "image_url"]
+    if "response_format" not in payload:
+        return _describe_image(images[0]) if images else "stub answer"
+
+    texts = [part["text"] for part in parts if part.get("type") == "text"]
+    labels = [text[:-1] for text in texts if text.endswith(":")]
+    if not labels:
+        match = _LABEL_LIST_PATTERN.search(" ".join(texts))
+        labels = [label.strip() for label in match.group(1).split(",")] if match else []
+    items = [
+        {"label": label, "description": _describe_image(images[i]) if i < len(images) else f"stub description of {label}"}
+        for i, label in enumerate(labels)
+    ]
+    return json.dumps({"items": items})
+
+
+def _make_handler(state: _StubState):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1" # 支援 keep-alive，才能驗證客戶端的連線重用
+
+        def setup(self):
+            super().setup()
+            with state.lock:
+                state.connections += 1
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status: int, body: dict) -> None:
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _send_stream(self, payload: dict, delay: float) -> None:
+            # 一半的延遲用在第一段文字之前，其餘平均分配在之後的每一段 (chunked transfer encoding)
+            words = _answer(payload).split(" ")
+            time.sleep(delay / 2)
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for index, word in enumerate(words):
+                if index:
+                    time.sleep(delay / 2 / max(len(words) - 1, 1))
+                delta = {"choices": [{"index": 0, "delta": {"content": word if index == 0 else " " + word}}]}
+                self._write_chunk(f"data: {json.dumps(delta)}\n\n".encode())
+            self._write_chunk(b"data: [DONE]\n\n")
+            self._write_chunk(b"")
+
+        def _write_chunk(self, data: bytes) -> None:
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        def do_GET(self):
+            if self.path.rstrip("/").endswith("/stats"):
+                self._send_json(200, state.as_dict())
+            else:
+                self._send_json(404, {"error": {"message": "not found"}})
+
+        def do_POST(self):
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": "not found"}})
+                return
+            options = state.options
+            with state.lock:
+                state.requests += 1
+                fail = options.random.random() < options.failure_rate
+                slow = options.random.random() < options.tail_rate
+                delay = options.tail_latency_ms if slow else options.latency_ms + options.random.uniform(-1, 1) * options.jitter_ms
+                if fail:
+                    state.failures += 1
+            if payload.get("stream") and not fail:
+                self._send_stream(payload, max(delay, 0.0) / 1000)
+                return
+            time.sleep(max(delay, 0.0) / 1000)
+            if fail:
+                self._send_json(options.failure_status, {"error": {"message": "injected failure"}})
+                return
+            self._send_json(200, {
+                "id": f"stub-{state.requests}",
+                "object": "chat.completion",
+                "model": payload.get("model", "stub"),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": _answer(payload)}}],
+            })
+
+    return Handler
+
+
+def start_stub_server(host: str = "127.0.0.1", port: int = 0, options: Optional[StubOptions] = None) -> ThreadingHTTPServer:
+    """
+    Starts the stub in a daemon thread and returns the server; port 0 picks a free port
+    (see server.server_address). Call server.shutdown() to stop it.
+    """
+    state = _StubState(options or StubOptions())
+    server = ThreadingHTTPServer((host, port), _make_handler(state))
+    server.daemon_threads = True
+    server.stub_state = state
+    threading.Thread(target=server.serve_forever, name="stub-vision-server", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency-ms", type=float, default=200.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--failure-status", type=int, default=503)
+    parser.add_argument("--tail-rate", type=float, default=0.0)
+    parser.add_argument("--tail-latency-ms", type=float, default=2000.0)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    options = StubOptions(args.latency_ms, args.jitter_ms, args.failure_rate, args.failure_status,
+                          args.tail_rate, args.tail_latency_ms, args.seed)
+    server = start_stub_server(args.host, args.port, options)
+    host, port = server.server_address[:2]
+    print(f"Stub vision server listening on http://{host}:{port}/v1 (GET /v1/stats for counters)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
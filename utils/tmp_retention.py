@@ -0,0 +1,57 @@
+import os
+import time
+from pathlib import Path
+from typing import Optional
+
+
+def enforce_retention(directory: Path, max_bytes: Optional[int] = None, max_age_seconds: Optional[float] = None) -> int:
+    """
+    Deletes files in directory (non-recursive) that are older than max_age_seconds, then the
+    oldest remaining files until the directory holds at most max_bytes. Defaults come from
+    MCP_TMP_MAX_BYTES (200 MB) and MCP_TMP_MAX_AGE_SECONDS (1 hour). Returns the number of
+    files removed. Errors on individual files are ignored; another process may be cleaning too.
+    """
+    if max_bytes is None:
+        max_bytes = int(os.getenv("MCP_TMP_MAX_BYTES", str(200 * 1024 * 1024)))
+    if max_age_seconds is None:
+        max_age_seconds = float(os.getenv("MCP_TMP_MAX_AGE_SECONDS", "3600"))
+
+    entries = []
+    try:
+        with os.scandir(directory) as it:
+            for entry in it:
+                try:
+                    if entry.is_file(follow_symlinks=False):
+                        stat = entry.stat(follow_symlinks=False)
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+                except OSError:
+                    continue
+    except FileNotFoundError:
+        return 0
+
+    now = time.time()
+    removed = 0
+    kept = []
+    for mtime, size, path in entries:
+        if max_age_seconds > 0 and now - mtime > max_age_seconds:
+            removed += _unlink(path)
+        else:
+            kept.append((mtime, size, path))
+
+    total = sum(size for _, size, _ in kept)
+    if max_bytes > 0 and total > max_bytes:
+        for mtime, size, path in sorted(kept):  # 最舊的先刪
+            if total <= max_bytes:
+                break
+            if _unlink(path):
+                removed += 1
+                total -= size
+    return removed
+
+
+def _unlink(path: str) -> int:
+    try:
+        os.unlink(path)
+        return 1
+    except OSError:
+        return 0
@@ -0,0 +1,90 @@
+import functools
+import importlib
+import sys
+import time
+from typing import Optional
+
+from pydantic import BaseModel
+
+from utils.perf_metrics import span
+
+# 行程啟動後第一次匯入本模組的時間，作為啟動時間的起點
+_started = time.perf_counter()
+
+
+class ToolModuleStatus(BaseModel):
+    module: str
+    tools: list[str]
+    available: bool
+    import_ms: float # 匯入此模組新增的時間 (已被先前模組載入的相依套件不重複計算)
+    error: Optional[str] = None
+
+
+_module_statuses: list[ToolModuleStatus] = []
+_startup_ms: Optional[float] = None
+
+
+def register_tools(mcp, module_name: str, tool_names: list[str]) -> ToolModuleStatus:
+    """
+    Imports module_name and registers the named functions as MCP tools. If the import fails,
+    each tool is registered as a stub that reports why it is unavailable, so one broken
+    dependency does not take down the whole server. The import time is printed to stderr
+    (stdout is the stdio transport) and kept for get_server_status. Every call of a registered
+    tool is recorded as a "tool.<name>" span (see get_performance_metrics).
+    """
+    started = time.perf_counter()
+    error = None
+    try:
+        module = importlib.import_module(module_name)
+        functions = [getattr(module, name) for name in tool_names]
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        for name in tool_names:
+            _register_unavailable(mcp, name, error)
+    else:
+        for fn in functions:
+            mcp.tool()(_timed(fn))
+
+    status = ToolModuleStatus(
+        module=module_name,
+        tools=tool_names,
+        available=error is None,
+        import_ms=round((time.perf_counter() - started) * 1000, 3),
+        error=error,
+    )
+    _module_statuses.append(status)
+    suffix = "" if error is None else f" (unavailable: {error})"
+    print(f"[startup] {module_name}: {status.import_ms:.1f} ms{suffix}", file=sys.stderr)
+    return status
+
+
+def _timed(fn):
+    # functools.wraps 保留原函數的簽名與說明，FastMCP 仍能產生相同的參數 schema 並注入 Context
+    @functools.wraps(fn)
+    async def timed(*args, **kwargs):
+        with span(f"tool.{fn.__name__}"):
+            return await fn(*args, **kwargs)
+    return timed
+
+
+def _register_unavailable(mcp, name: str, error: str) -> None:
+    async def unavailable() -> str:
+        return f"Tool '{name}' is unavailable: {error}"
+
+    mcp.tool(name=name, description=f"Unavailable: {error}")(unavailable)
+
+
+def mark_startup_complete() -> float:
+    """Records and prints the time from the first import of this module until the server is ready."""
+    global _startup_ms
+    _startup_ms = round((time.perf_counter() - _started) * 1000, 3)
+    print(f"[startup] tools registered in {_startup_ms:.1f} ms", file=sys.stderr)
+    return _startup_ms
+
+
+def get_module_statuses() -> list[ToolModuleStatus]:
+    return list(_module_statuses)
+
+
+def get_startup_ms() -> Optional[float]:
+    return _startup_ms
@@ -0,0 +1,234 @@
+import base64
+import json
+import os
+from typing import Any, AsyncIterator, Optional, Union
+
+import httpx
+from pydantic import TypeAdapter
+
+DEFAULT_GEMINI_MODEL = "gemini-2.5-flash-preview-04-17"
+DEFAULT_OPENAI_MODEL = "gpt-4o-mini"
+
+
+class ImagePart:
+    """An encoded image in a backend-neutral request."""
+
+    __slots__ = ("data", "mime_type")
+
+    def __init__(self, data: bytes, mime_type: str):
+        self.data = data
+        self.mime_type = mime_type
+
+
+ContentPart = Union[str, ImagePart]
+
+
+class BackendResponse:
+    """A backend-neutral model answer. parsed holds the validated object when a response_schema was requested."""
+
+    __slots__ = ("text", "parsed")
+
+    def __init__(self, text: Optional[str], parsed: Any = None):
+        self.text = text
+        self.parsed = parsed
+
+
+def _http_limits() -> httpx.Limits:
+    # 連線池大小應不小於 GENAI_MAX_CONCURRENCY，讓並行請求都能重用 keep-alive 連線
+    max_connections = int(os.getenv("GENAI_HTTP_MAX_CONNECTIONS", "32"))
+    return httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_connections,
+        keepalive_expiry=float(os.getenv("GENAI_HTTP_KEEPALIVE_SECONDS", "60")),
+    )
+
+
+class VisionBackend:
+    """
+    A vision model endpoint. Each backend owns one long-lived HTTP client with a keep-alive
+    connection pool, created on first use and shared by every call in the process (see get_backend).
+    Timeouts and retries are applied by the caller (utils.request_scheduler).
+    """
+
+    name = ""
+
+    def __init__(self, default_model: str):
+        self.default_model = default_model
+
+    async def generate(self, model: str, parts: list[ContentPart], response_schema: Any = None) -> BackendResponse:
+        raise NotImplementedError
+
+    async def generate_stream(self, model: str, parts: list[ContentPart]) -> AsyncIterator[str]:
+        """Yields the answer in text chunks as the model produces them. Defaults to one chunk."""
+        response = await self.generate(model, parts)
+        yield response.text or ""
+
+    async def aclose(self) -> None:
+        pass
+
+
+class GeminiBackend(VisionBackend):
+    """Google Gemini through google-genai. The SDK is imported when the first request is made."""
+
+    name = "gemini"
+
+    def __init__(self, api_key: Optional[str] = None, default_model: Optional[str] = None):
+        super().__init__(default_model or os.getenv("GENAI_MODEL", DEFAULT_GEMINI_MODEL))
+        self._api_key = api_key or os.getenv("genaikey")
+        self._client = None
+
+    def _get_client(self):
+        if self._client is None:
+            if not self._api_key:
+                raise ValueError("Google API Key not found. Please set the 'genaikey' environment variable.")
+            from google import genai
+            from google.genai import types
+            self._client = genai.Client(
+                api_key=self._api_key,
+                http_options=types.HttpOptions(async_client_args={"limits": _http_limits()}),
+            )
+        return self._client
+
+    async def generate(self, model: str, parts: list[ContentPart], response_schema: Any = None) -> BackendResponse:
+        from google.genai import types
+        client = self._get_client()
+        contents = [
+            part if isinstance(part, str) else types.Part.from_bytes(data=part.data, mime_type=part.mime_type)
+            for part in parts
+        ]
+        config = None
+        if response_schema is not None:
+            config = types.GenerateContentConfig(response_mime_type="application/json", response_schema=response_schema)
+        response = await client.aio.models.generate_content(model=model, contents=contents, config=config)
+        return BackendResponse(response.text, getattr(response, "parsed", None) if response_schema is not None else None)
+
+    async def generate_stream(self, model: str, parts: list[ContentPart]) -> AsyncIterator[str]:
+        from google.genai import types
+        client = self._get_client()
+        contents = [
+            part if isinstance(part, str) else types.Part.from_bytes(data=part.data, mime_type=part.mime_type)
+            for part in parts
+        ]
+        async for chunk in await client.aio.models.generate_content_stream(model=model, contents=contents):
+            yield chunk.text or ""
+
+
+class OpenAICompatibleBackend(VisionBackend):
+    """
+    Any endpoint implementing OpenAI's /chat/completions with image_url content parts
+    (OpenAI, vLLM, Ollama, LM Studio, utils.stub_vision_server, ...).
+    """
+
+    name = "openai"
+
+    def __init__(self, base_url: Optional[str] = None, api_key: Optional[str] = None, default_model: Optional[str] = None):
+        super().__init__(default_model or os.getenv("OPENAI_MODEL", DEFAULT_OPENAI_MODEL))
+        self.base_url = (base_url or os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")).rstrip("/")
+        self._api_key = api_key if api_key is not None else os.getenv("OPENAI_API_KEY", "")
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            headers = {"Authorization": f"Bearer {self._api_key}"} if self._api_key else {}
+            # 逾時由 call_with_retries 控制，這裡不另設 httpx 的預設 5 秒逾時
+            self._client = httpx.AsyncClient(base_url=self.base_url, headers=headers, limits=_http_limits(), timeout=None)
+        return self._client
+
+    @staticmethod
+    def _messages(parts: list[ContentPart]) -> list[dict]:
+        content = []
+        for part in parts:
+            if isinstance(part, str):
+                content.append({"type": "text", "text": part})
+            else:
+                data_url = f"data:{part.mime_type};base64,{base64.b64encode(part.data).decode('ascii')}"
+                content.append({"type": "image_url", "image_url": {"url": data_url}})
+        return [{"role": "user", "content": content}]
+
+    async def generate(self, model: str, parts: list[ContentPart], response_schema: Any = None) -> BackendResponse:
+        payload = {"model": model, "messages": self._messages(parts)}
+
+        adapter = None
+        if response_schema is not None:
+            adapter = TypeAdapter(response_schema)
+            # json_schema 的頂層必須是物件，因此把結果包在 items 欄位中
+            schema = adapter.json_schema()
+            definitions = schema.pop("$defs", None)
+            wrapped = {"type": "object", "properties": {"items": schema}, "required": ["items"]}
+            if definitions:
+                wrapped["$defs"] = definitions
+            payload["response_format"] = {"type": "json_schema", "json_schema": {"name": "response", "schema": wrapped}}
+
+        response = await self._get_client().post("/chat/completions", json=payload)
+        response.raise_for_status() # httpx.HTTPStatusError 帶有 status_code，429/5xx 會被重試
+        text = response.json()["choices"][0]["message"]["content"]
+
+        parsed = None
+        if adapter is not None and text:
+            try:
+                value = json.loads(text)
+                if isinstance(value, dict) and "items" in value:
+                    value = value["items"]
+                parsed = adapter.validate_python(value)
+            except ValueError:
+                parsed = None
+        return BackendResponse(text, parsed)
+
+    async def generate_stream(self, model: str, parts: list[ContentPart]) -> AsyncIterator[str]:
+        payload = {"model": model, "messages": self._messages(parts), "stream": True}
+        async with self._get_client().stream("POST", "/chat/completions", json=payload) as response:
+            response.raise_for_status()
+            # Server-sent events: 每行 "data: {chunk}"，以 "data: [DONE]" 結束
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                choices = json.loads(data).get("choices") or [{}]
+                yield choices[0].get("delta", {}).get("content") or ""
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+BACKEND_TYPES: dict[str, type[VisionBackend]] = {
+    GeminiBackend.name: GeminiBackend,
+    OpenAICompatibleBackend.name: OpenAICompatibleBackend,
+}
+
+# 整個行程共用的 backend 實例 (連線池因此在所有工具呼叫之間重用)
+_backends: dict[str, VisionBackend] = {}
+
+
+def get_backend(name: Optional[str] = None) -> VisionBackend:
+    """Returns the process-wide backend instance; name defaults to GENAI_BACKEND (gemini)."""
+    name = name or os.getenv("GENAI_BACKEND", GeminiBackend.name)
+    if name not in BACKEND_TYPES:
+        raise ValueError(f"Unknown vision backend '{name}'. Available: {', '.join(BACKEND_TYPES)}")
+    backend = _backends.get(name)
+    if backend is None:
+        backend = _backends[name] = BACKEND_TYPES[name]()
+    return backend
+
+
+def resolve_model(model: Optional[str] = None) -> tuple[VisionBackend, str]:
+    """
+    Resolves a per-call model selection: "openai:gpt-4o" or "gemini:gemini-2.0-flash" pick the backend
+    explicitly, a bare name uses the default backend, and None uses the default backend's default model.
+    """
+    backend_name = None
+    if model and ":" in model:
+        prefix, _, rest = model.partition(":")
+        if prefix in BACKEND_TYPES: # 其他含冒號的名稱 (例如 Ollama 的 "llava:13b") 視為模型名稱
+            backend_name, model = prefix, rest
+    backend = get_backend(backend_name)
+    return backend, model or backend.default_model
+
+
+async def close_backends() -> None:
+    for backend in list(_backends.values()):
+        await backend.aclose()
+    _backends.clear()